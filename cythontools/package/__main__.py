@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import argparse
+
+from pathlib import Path
+
+
+def watch(args: argparse.Namespace):
+    from cythontools.package.watch import PackageWatcher
+    from cythontools.package.builder import CythonBuilder
+
+    package_paths = list(dict.fromkeys(args.package_paths))
+
+    package_name = args.name
+    if package_name is None:
+        names = {path.stem for path in package_paths}
+        assert len(names) == 1, "Cannot infer package name"
+
+        (package_name,) = names
+
+    builder = CythonBuilder(
+        working_path=args.working_path,
+        language_level=args.language_level,
+        annotate_html=args.annotate_html,
+        verbose=args.verbose,
+        quiet=args.quiet,
+    )
+
+    watcher = PackageWatcher(
+        builder=builder,
+        package_name=package_name,
+        package_paths=package_paths,
+        output_path=args.output_path,
+        build_temp=args.build_temp,
+        poll_interval=args.poll_interval,
+        shard=args.shard,
+        shard_size=args.shard_size,
+    )
+
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m cythontools.package")
+    subparsers = parser.add_subparsers(required=True)
+
+    watch_parser = subparsers.add_parser(
+        "watch", help="Rebuild a bundled extension whenever its sources change"
+    )
+    watch_parser.set_defaults(command=watch)
+    watch_parser.add_argument("package_paths", nargs="+", type=Path)
+    watch_parser.add_argument("--name", default=None)
+    watch_parser.add_argument("--output-path", type=Path, default=Path("."))
+    watch_parser.add_argument(
+        "--working-path", type=Path, default=Path("./build/generated/")
+    )
+    watch_parser.add_argument("--build-temp", type=Path, default=Path("./build/temp/"))
+    watch_parser.add_argument("--poll-interval", type=float, default=0.25)
+    watch_parser.add_argument("--language-level", type=int, default=3)
+    watch_parser.add_argument("--annotate-html", action="store_true")
+    watch_parser.add_argument("--shard", action="store_true")
+    watch_parser.add_argument("--shard-size", type=int, default=None)
+    verbosity = watch_parser.add_mutually_exclusive_group()
+    verbosity.add_argument("--verbose", action="store_true")
+    verbosity.add_argument("--quiet", action="store_true")
+
+    args = parser.parse_args(argv)
+    args.command(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,131 @@
 from __future__ import annotations
 
+import sys
+import shutil
+import platform
+import sysconfig
+import functools
+
 from types import ModuleType
 from pathlib import Path
 from setuptools import Extension
+from setuptools.modified import newer_group
+from setuptools.command.build_ext import build_ext
 from dataclasses import dataclass, field
+from distutils.ccompiler import CCompiler, new_compiler
+from distutils.sysconfig import customize_compiler
 
-from cythontools.package.common import ModuleDef
-from cythontools.package.core import cythonize_package
+from cythontools.package.common import ModuleDef, needs_update, update_file
+from cythontools.package.core import (
+    build_variant_name,
+    cythonize_package,
+    cythonize_packages,
+    generate_cpu_dispatcher,
+    generate_executable_main,
+)
 from cythontools.package.preprocessors import (
     BasePreprocessor,
     default_preprocessors,
 )
 
 
+def compile_stale(
+    compiler: CCompiler,
+    sources: list[str],
+    output_dir: str | None = None,
+    depends: list[str] | None = None,
+    force: bool = False,
+    **kwargs,
+) -> list[str]:
+    """
+    Same as `CCompiler.compile`, but skips the sources which are older than their objects.
+
+    :param compiler: Compiler used to build the objects
+    :param sources: Source files, see `CCompiler.compile`
+    :param output_dir: Directory for the objects, see `CCompiler.compile`
+    :param depends: Extra files which invalidate every object, see `CCompiler.compile`
+    :param force: Compile all sources, defaults to False
+    :return: Object files for all `sources`
+    """
+    objects = compiler.object_filenames(sources, output_dir=output_dir)
+    stale_sources = [
+        source
+        for source, object in zip(sources, objects)
+        if force or newer_group([source, *(depends or [])], object)
+    ]
+
+    if stale_sources:
+        type(compiler).compile(
+            compiler, stale_sources, output_dir=output_dir, depends=depends, **kwargs
+        )
+
+    return objects
+
+
+class IncrementalBuildExt(build_ext):
+    """
+    A `build_ext` command which only recompiles the `*.c` files that are newer than their objects.
+
+    NOTE:
+      The stock `build_ext` recompiles every source of an extension as soon as one of them changes.
+      Bundled extensions are made of many independent `*.c` files, so after an edit we only want to
+      recompile the modules which were recythonized (and `bootstrap`) before relinking.
+
+    NOTE:
+      Removing a source doesn't make the remaining objects newer than the extension, so the sources
+      of each extension are kept in `build_temp` and the extension is relinked when they change.
+    """
+
+    def build_extension(self, ext: Extension):
+        sources_path = Path(self.build_temp) / f"{ext.name}.sources"
+        sources = "".join(f"{source}\n" for source in ext.sources)
+        relink = not sources_path.exists() or sources_path.read_text() != sources
+
+        force = self.force
+        compiler_force = self.compiler.force
+        self.compiler.compile = functools.partial(
+            compile_stale, self.compiler, force=force
+        )
+        self.force = self.compiler.force = force or relink
+        try:
+            super().build_extension(ext)
+        finally:
+            del self.compiler.compile
+            self.force = force
+            self.compiler.force = compiler_force
+
+        sources_path.parent.mkdir(parents=True, exist_ok=True)
+        update_file(sources_path, sources)
+
+
 @dataclass(frozen=True, kw_only=True)
 class CythonBuilder:
     # TODO@Daniel: Add more options as needed
     preprocessors: list[BasePreprocessor] = field(default_factory=default_preprocessors)
     working_path: Path = Path("./build/generated/")
+    data_patterns: list[str] = field(default_factory=list)
     language_level: int = 3
     annotate_html: bool = False
     annotate_coverage: bool = False
     check_timestamps: bool = True
     verbose: bool = False
     quiet: bool = False
+    deterministic: bool = False
+
+    def build_compile_args(self, extra_compile_args: list[str] | None) -> list[str]:
+        """
+        :param extra_compile_args: Compiler arguments given by the user
+        :return: The arguments, with `-ffile-prefix-map` added for deterministic builds, so the debug info
+                 doesn't depend on the checkout path (not supported by MSVC)
+        """
+        extra_compile_args = [*(extra_compile_args or [])]
+        if self.deterministic and sys.platform != "win32":
+            extra_compile_args += [
+                f"-ffile-prefix-map={self.working_path.resolve()}=.",
+                f"-ffile-prefix-map={Path.cwd()}=.",
+            ]
+
+        return extra_compile_args
 
     def build(
         self,
@@ -35,14 +137,134 @@ class CythonBuilder:
             package_paths=package_paths,
             preprocessors=self.preprocessors,
             working_path=self.working_path,
+            data_patterns=self.data_patterns,
             language_level=self.language_level,
             annotate_html=self.annotate_html,
             annotate_coverage=self.annotate_coverage,
             check_timestamps=self.check_timestamps,
             verbose=self.verbose,
             quiet=self.quiet,
+            deterministic=self.deterministic,
+        )
+
+    def build_packages(
+        self,
+        extension_name: str,
+        packages: dict[str, list[Path] | Path],
+        shard: bool = False,
+        shard_size: int | None = None,
+    ) -> list[ModuleDef]:
+        return cythonize_packages(
+            extension_name=extension_name,
+            packages=packages,
+            preprocessors=self.preprocessors,
+            working_path=self.working_path,
+            data_patterns=self.data_patterns,
+            language_level=self.language_level,
+            annotate_html=self.annotate_html,
+            annotate_coverage=self.annotate_coverage,
+            check_timestamps=self.check_timestamps,
+            verbose=self.verbose,
+            quiet=self.quiet,
+            deterministic=self.deterministic,
+            shard=shard,
+            shard_size=shard_size,
+        )
+
+    def make_executable_from_packages(
+        self,
+        name: str,
+        packages: dict[str, str | Path | list[str | Path]],
+        main_module: str,
+        output_path: Path = Path("."),
+        build_temp: Path = Path("./build/temp/"),
+        isolated: bool = False,
+        site_import: bool = True,
+        home: str | None = None,
+        include_dirs: list[str] | None = None,
+        define_macros: list[tuple[str, str | None]] | None = None,
+        extra_compile_args: list[str] | None = None,
+        extra_link_args: list[str] | None = None,
+        force: bool = False,
+    ) -> Path:
+        """
+        Build an executable with an embedded interpreter and the bundled extension linked in statically.
+        The entry point is `main_module`'s `__cythontools_main__`, see `generate_executable_main`.
+
+        :param name: Name of the bundled extension and the executable
+        :param packages: Packages to bundle, see `make_extension_from_packages`
+        :param main_module: Module whose `__cythontools_main__` is called on startup
+        :param output_path: Directory for the executable, defaults to Path(".")
+        :param build_temp: Directory for object files, defaults to Path("./build/temp/")
+        :param isolated: Ignore the environment and user site-packages at runtime, defaults to False
+        :param site_import: Import `site` at runtime, defaults to True
+        :param home: Python home of the embedded interpreter, defaults to None
+        :param force: Recompile all objects and relink, defaults to False
+        :return: Path to the executable
+        """
+        extension = self.make_extension_from_packages(
+            name=name,
+            packages=packages,
+            include_dirs=include_dirs,
+            define_macros=define_macros,
+            extra_compile_args=extra_compile_args,
+        )
+        main_path = generate_executable_main(
+            name,
+            main_module,
+            working_path=self.working_path,
+            isolated=isolated,
+            site_import=site_import,
+            home=home,
         )
 
+        compiler = new_compiler(verbose=self.verbose, force=force)
+        customize_compiler(compiler)
+
+        config = sysconfig.get_config_vars()
+
+        objects = compile_stale(
+            compiler,
+            [*map(str, extension.sources), str(main_path)],
+            output_dir=str(build_temp),
+            macros=extension.define_macros,
+            include_dirs=[
+                sysconfig.get_path("include"),
+                sysconfig.get_path("platinclude"),
+                *extension.include_dirs,
+            ],
+            extra_postargs=extension.extra_compile_args,
+            force=force,
+        )
+
+        link_args = [
+            *config.get("LIBS", "").split(),
+            *config.get("SYSLIBS", "").split(),
+        ]
+        if not config.get("Py_ENABLE_SHARED"):
+            # NOTE:
+            #   With a static libpython, regular extension modules imported at runtime
+            #   resolve the C API from the executable itself, so its symbols must be exported
+            link_args += config.get("LINKFORSHARED", "").split()
+
+        executable_path = output_path / compiler.executable_filename(name)
+        if force or newer_group(objects, str(executable_path)):
+            compiler.link_executable(
+                objects,
+                name,
+                output_dir=str(output_path),
+                libraries=[f"python{config['LDVERSION']}"],
+                library_dirs=[config["LIBPL"], config["LIBDIR"]],
+                # NOTE:
+                #   Some distributions (e.g. conda) ship only a shared libpython,
+                #   even if the interpreter itself is linked statically
+                runtime_library_dirs=[config["LIBDIR"]],
+                extra_postargs=[*link_args, *(extra_link_args or [])],
+                target_lang="c",
+            )
+
+        return executable_path
+
     def as_build_ext(self):
         pass
 
@@ -70,14 +292,66 @@ class CythonBuilder:
         if isinstance(package_paths, (str, Path)):
             package_paths = [package_paths]
 
-        package_paths: list[Path] = list({Path(path) for path in package_paths})
+        package_paths: list[Path] = list(
+            dict.fromkeys(Path(path) for path in package_paths)
+        )
         if name is None:
             names = {path.stem for path in package_paths}
             assert len(names) == 1, "Cannot infer package name"
 
             (name,) = names
 
-        module_specs = self.build(name, package_paths)
+        return self.make_extension_from_packages(
+            name=name,
+            packages={name: package_paths},
+            include_dirs=include_dirs,
+            define_macros=define_macros,
+            undef_macros=undef_macros,
+            library_dirs=library_dirs,
+            libraries=libraries,
+            runtime_library_dirs=runtime_library_dirs,
+            extra_objects=extra_objects,
+            extra_compile_args=extra_compile_args,
+            extra_link_args=extra_link_args,
+            export_symbols=export_symbols,
+            swig_opts=swig_opts,
+            depends=depends,
+            language=language,
+            optional=optional,
+            py_limited_api=py_limited_api,
+        )
+
+    def make_extension_from_packages(
+        self,
+        name: str,
+        packages: dict[str, str | Path | list[str | Path]],
+        include_dirs: list[str] | None = None,
+        define_macros: list[tuple[str, str | None]] | None = None,
+        undef_macros: list[str] | None = None,
+        library_dirs: list[str] | None = None,
+        libraries: list[str] | None = None,
+        runtime_library_dirs: list[str] | None = None,
+        extra_objects: list[str] | None = None,
+        extra_compile_args: list[str] | None = None,
+        extra_link_args: list[str] | None = None,
+        export_symbols: list[str] | None = None,
+        swig_opts: list[str] | None = None,
+        depends: list[str] | None = None,
+        language: str | None = None,
+        optional: bool | None = None,
+        *,
+        py_limited_api: bool = False,
+    ):
+        package_paths: dict[str, list[Path]] = {}
+        for package_name, paths in packages.items():
+            if isinstance(paths, (str, Path)):
+                paths = [paths]
+
+            package_paths[package_name] = list(
+                dict.fromkeys(Path(path) for path in paths)
+            )
+
+        module_specs = self.build_packages(name, package_paths)
         sources = [module_spec.c_path for module_spec in module_specs]
 
         if define_macros is None:
@@ -85,6 +359,8 @@ class CythonBuilder:
 
         define_macros.append(("CYTHON_NO_PYINIT_EXPORT", None))
 
+        extra_compile_args = self.build_compile_args(extra_compile_args)
+
         return Extension(
             name,
             sources,
@@ -105,6 +381,199 @@ class CythonBuilder:
             py_limited_api=py_limited_api,
         )
 
+    def make_sharded_extensions_from_packages(
+        self,
+        name: str,
+        packages: dict[str, str | Path | list[str | Path]],
+        shard_size: int | None = None,
+        include_dirs: list[str] | None = None,
+        define_macros: list[tuple[str, str | None]] | None = None,
+        undef_macros: list[str] | None = None,
+        library_dirs: list[str] | None = None,
+        libraries: list[str] | None = None,
+        runtime_library_dirs: list[str] | None = None,
+        extra_objects: list[str] | None = None,
+        extra_compile_args: list[str] | None = None,
+        extra_link_args: list[str] | None = None,
+        export_symbols: list[str] | None = None,
+        swig_opts: list[str] | None = None,
+        depends: list[str] | None = None,
+        language: str | None = None,
+        optional: bool | None = None,
+        *,
+        py_limited_api: bool = False,
+    ) -> list[Extension]:
+        """
+        Same as `make_extension_from_packages`, but each top-level subpackage is linked into
+        a separate extension shard, which is only loaded once one of its modules is imported.
+        See `cythonize_packages` and `build_shard_names`.
+
+        NOTE:
+          All returned extensions must be installed in the same directory.
+
+        :param shard_size: Split the shards further by the size of their generated C code, defaults to None
+        :return: The root extension, followed by its shards
+        """
+        package_paths: dict[str, list[Path]] = {}
+        for package_name, paths in packages.items():
+            if isinstance(paths, (str, Path)):
+                paths = [paths]
+
+            package_paths[package_name] = list(
+                dict.fromkeys(Path(path) for path in paths)
+            )
+
+        module_specs = self.build_packages(
+            name, package_paths, shard=True, shard_size=shard_size
+        )
+
+        extension_sources: dict[str, list[Path]] = {name: []}
+        for module_spec in module_specs:
+            extension_sources.setdefault(module_spec.shard_name or name, []).append(
+                module_spec.c_path
+            )
+
+        if define_macros is None:
+            define_macros = []
+
+        define_macros.append(("CYTHON_NO_PYINIT_EXPORT", None))
+
+        extra_compile_args = self.build_compile_args(extra_compile_args)
+
+        return [
+            Extension(
+                extension_name,
+                sources,
+                include_dirs=include_dirs,
+                define_macros=define_macros,
+                undef_macros=undef_macros,
+                library_dirs=library_dirs,
+                libraries=libraries,
+                runtime_library_dirs=runtime_library_dirs,
+                extra_objects=extra_objects,
+                extra_compile_args=extra_compile_args,
+                extra_link_args=extra_link_args,
+                export_symbols=export_symbols,
+                swig_opts=swig_opts,
+                depends=depends,
+                language=language,
+                optional=optional,
+                py_limited_api=py_limited_api,
+            )
+            for extension_name, sources in extension_sources.items()
+        ]
+
+    def make_multiversioned_extensions_from_packages(
+        self,
+        name: str,
+        packages: dict[str, str | Path | list[str | Path]],
+        cpu_levels: list[str] | None = None,
+        include_dirs: list[str] | None = None,
+        define_macros: list[tuple[str, str | None]] | None = None,
+        undef_macros: list[str] | None = None,
+        library_dirs: list[str] | None = None,
+        libraries: list[str] | None = None,
+        runtime_library_dirs: list[str] | None = None,
+        extra_objects: list[str] | None = None,
+        extra_compile_args: list[str] | None = None,
+        extra_link_args: list[str] | None = None,
+        depends: list[str] | None = None,
+        language: str | None = None,
+        optional: bool | None = None,
+    ) -> list[Extension]:
+        """
+        Same as `make_extension_from_packages`, but the bundled extension is compiled once for each
+        of `cpu_levels` (with `-march=<level>`) and a small dispatcher extension loads the best variant
+        for the CPU at import time. See `generate_cpu_dispatcher`.
+
+        NOTE:
+          The generated `*.c` files are copied for each variant, so their objects don't collide in `build_temp`.
+
+        NOTE:
+          All returned extensions must be installed in the same directory.
+          Only GCC and Clang are supported, since the variants are compiled with `-march`.
+
+        NOTE:
+          `CPU_LEVELS` are x86-64 levels, so on other hosts only the plain bundled extension is returned.
+
+        :param cpu_levels: Levels from `CPU_LEVELS`, defaults to None, i.e. `["x86-64", "x86-64-v3"]`
+        :return: The dispatcher extension, followed by the variants
+        """
+        if cpu_levels is None:
+            cpu_levels = ["x86-64", "x86-64-v3"]
+
+        extension = self.make_extension_from_packages(
+            name=name,
+            packages=packages,
+            include_dirs=include_dirs,
+            define_macros=define_macros,
+            undef_macros=undef_macros,
+            library_dirs=library_dirs,
+            libraries=libraries,
+            runtime_library_dirs=runtime_library_dirs,
+            extra_objects=extra_objects,
+            extra_compile_args=extra_compile_args,
+            extra_link_args=extra_link_args,
+            depends=depends,
+            language=language,
+            optional=optional,
+        )
+
+        if platform.machine().lower() not in {"x86_64", "amd64"}:
+            return [extension]
+
+        dispatch_path = generate_cpu_dispatcher(
+            name, cpu_levels, working_path=self.working_path
+        )
+
+        extensions = [
+            Extension(
+                name,
+                [str(dispatch_path)],
+                libraries=["dl"] if sys.platform.startswith("linux") else [],
+                optional=optional,
+            )
+        ]
+        for cpu_level in cpu_levels:
+            variant_name = build_variant_name(name, cpu_level)
+            variant_path = self.working_path / "variants" / variant_name
+
+            sources: list[str] = []
+            for source in map(Path, extension.sources):
+                variant_source = variant_path / source.relative_to(self.working_path)
+                if not variant_source.exists() or needs_update(
+                    [source], [variant_source]
+                ):
+                    variant_source.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copyfile(source, variant_source)
+
+                sources.append(str(variant_source))
+
+            extensions.append(
+                Extension(
+                    variant_name,
+                    sources,
+                    include_dirs=[*extension.include_dirs, str(self.working_path)],
+                    define_macros=extension.define_macros,
+                    undef_macros=extension.undef_macros,
+                    library_dirs=extension.library_dirs,
+                    libraries=extension.libraries,
+                    runtime_library_dirs=extension.runtime_library_dirs,
+                    extra_objects=extension.extra_objects,
+                    extra_compile_args=[
+                        *extension.extra_compile_args,
+                        f"-march={cpu_level}",
+                    ],
+                    extra_link_args=extension.extra_link_args,
+                    export_symbols=[f"PyInit_{name}"],
+                    depends=extension.depends,
+                    language=extension.language,
+                    optional=optional,
+                )
+            )
+
+        return extensions
+
     def make_extension_from_package(
         self,
         package: ModuleType,
@@ -126,7 +595,7 @@ class CythonBuilder:
         *,
         py_limited_api: bool = False,
     ):
-        package_paths = list({Path(path) for path in package.__path__})
+        package_paths = list(dict.fromkeys(Path(path) for path in package.__path__))
         name = name or package.__name__
 
         return self.make_extension_from_path(
@@ -12,11 +12,17 @@ def needs_update(input_paths: list[Path], output_paths: list[Path]):
     return inputs_modified > outputs_modified
 
 
-def update_file(path: Path, content: str):
+def update_file(path: Path, content: str) -> bool:
+    """
+    Writes `content` to `path`, unless it already holds it, which keeps its modification time.
+
+    :return: Whether the file was written
+    """
     if path.exists() and path.read_text() == content:
-        return
+        return False
 
     path.write_text(content)
+    return True
 
 
 @dataclass(frozen=True, kw_only=True)
@@ -33,6 +39,9 @@ class ModuleDef:
 
     custom_globals: dict = field(default_factory=dict)
 
+    # NOTE: Name of the extension shard the module is linked into, None for the root extension
+    shard_name: str | None = None
+
     @property
     def py_path(self) -> Path:
         return self.c_path.with_suffix(".py")
@@ -45,6 +54,20 @@ class ModuleDef:
     def pxd_path(self) -> Path:
         return self.c_path.with_suffix(".pxd")
 
+    @property
+    def is_declaration(self) -> bool:
+        """
+        Whether the module only consists of a `*.pxd` file, i.e. it only provides declarations for `cimport`
+        """
+        return self.py_source is None and self.pyx_source is None
+
+    @property
+    def source_path(self) -> Path:
+        if self.pyx_source is not None:
+            return self.pyx_path
+
+        return self.py_path
+
     @property
     def last_modified(self) -> float:
         paths = [self.py_path, self.pyx_path, self.pxd_path]
@@ -83,6 +106,7 @@ class ModuleDef:
             pyx_source=pyx_source,
             pxd_source=pxd_source,
             custom_globals=custom_globals,
+            shard_name=self.shard_name,
         )
 
     def save(self):
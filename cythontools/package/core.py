@@ -1,13 +1,16 @@
 from __future__ import annotations
 
+import os
 import hashlib
+import contextlib
+import dataclasses
 
 from pathlib import Path
 
 from Cython import Utils
 from Cython.Compiler.Main import compile
 
-from cythontools.package.common import ModuleDef
+from cythontools.package.common import ModuleDef, update_file
 from cythontools.package.preprocessors import BasePreprocessor
 
 
@@ -16,6 +19,91 @@ def build_initializer_name(module_name: str, is_package: bool) -> str:
     return f"_{md5}"
 
 
+def build_module_name(package_path: Path, module_path: Path) -> tuple[bool, str]:
+    """
+    :param package_path: Path to the package which contains the module
+    :param module_path: Path to a `.py/.pyx/.pxd` file inside `package_path`
+    :return: Whether the module is a package and its fully qualified name
+    """
+    relative_path = module_path.relative_to(package_path.parent)
+
+    if is_package := module_path.stem == "__init__":
+        module_name = relative_path.parent
+    else:
+        module_name = relative_path
+
+    module_name = (
+        str(module_name.with_suffix("")).replace("/", ".").replace("\\", ".").strip(".")
+    )
+    return is_package, module_name
+
+
+def load_module_def(
+    package_path: Path, module_path: Path, working_path: Path
+) -> ModuleDef:
+    """
+    Reads the sources of a module into a `ModuleDef`.
+    All of `.py`, `.pyx` and `.pxd` next to `module_path` are loaded, regardless of its suffix.
+
+    :param package_path: Path to the package which contains the module
+    :param module_path: Path to a `.py/.pyx/.pxd` file inside `package_path`
+    :param working_path: Working path for generated files
+    :return: The unprocessed `ModuleDef`
+    """
+    is_package, module_name = build_module_name(package_path, module_path)
+
+    initializer_name = build_initializer_name(
+        is_package=is_package, module_name=module_name
+    )
+
+    relative_path = module_path.relative_to(package_path.parent)
+    c_path = (working_path / relative_path).with_suffix(".c")
+    c_path.parent.mkdir(parents=True, exist_ok=True)
+
+    py_source = None
+    if (py_path := module_path.with_suffix(".py")) and py_path.exists():
+        py_source = py_path.read_text()
+
+    pyx_source = None
+    if (pyx_path := module_path.with_suffix(".pyx")) and pyx_path.exists():
+        pyx_source = pyx_path.read_text()
+
+    pxd_source = None
+    if (pxd_path := module_path.with_suffix(".pxd")) and pxd_path.exists():
+        pxd_source = pxd_path.read_text()
+
+    return ModuleDef(
+        is_package=is_package,
+        module_name=module_name,
+        initializer_name=initializer_name,
+        c_path=c_path,
+        py_source=py_source,
+        pyx_source=pyx_source,
+        pxd_source=pxd_source,
+    )
+
+
+@contextlib.contextmanager
+def current_directory(path: Path | None):
+    """
+    Temporarily change the current directory, does nothing if `path` is None.
+
+    NOTE:
+      Cython embeds the path of each source, relative to the current directory (if possible),
+      in the generated C code - in the file name table and the `co_filename` of code objects.
+    """
+    if path is None:
+        yield
+        return
+
+    previous_path = Path.cwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous_path)
+
+
 def cythonize_module(
     module_def: ModuleDef,
     language_level: int = 3,
@@ -24,6 +112,7 @@ def cythonize_module(
     check_timestamps: bool = True,
     verbose: bool = False,
     quiet: bool = False,
+    source_root: Path | None = None,
 ) -> bool:
     """
     Runs the Cython compiler on a module to generate the `*.c` source files.
@@ -52,6 +141,7 @@ def cythonize_module(
     :param check_timestamps: Cythonize only if changes are detected, defaults to True
     :param verbose: Include debug logs, defaults to False
     :param quiet: Do not emit logs, defaults to False
+    :param source_root: Run Cython from this directory, so the embedded source paths are relative to it, defaults to None
     :return: Whether the module was dirty, i.e. needed compilation
     """
     try:
@@ -69,17 +159,18 @@ def cythonize_module(
     if not dirty:
         return dirty
 
-    compile(
-        str(module_def.py_path),
-        full_module_name=module_def.module_name,
-        output_file=module_def.c_path,
-        module_name=module_def.module_name,
-        language_level=language_level,
-        annotate=annotate_html,
-        annotate_coverage_xml=annotate_coverage,
-        verbose=verbose,
-        quiet=quiet,
-    )
+    with current_directory(source_root):
+        compile(
+            str(module_def.source_path.resolve()),
+            full_module_name=module_def.module_name,
+            output_file=module_def.c_path.resolve(),
+            module_name=module_def.module_name,
+            language_level=language_level,
+            annotate=annotate_html,
+            annotate_coverage_xml=annotate_coverage,
+            verbose=verbose,
+            quiet=quiet,
+        )
 
     if module_def.is_package:
         stem = module_def.c_path.parent.stem
@@ -108,20 +199,248 @@ def cythonize_module(
     return dirty
 
 
-def cythonize_package(
-    package_name: str,
-    package_paths: list[Path] | Path,
+def find_data_files(
+    packages: dict[str, list[Path] | Path],
+    module_defs: list[ModuleDef],
+    data_patterns: list[str],
+) -> list[tuple[str, str, Path]]:
+    """
+    Find the data files which should be embedded in the extension.
+    Each file belongs to the innermost bundled package which contains it.
+
+    :param packages: Mapping from the final name of each root package to its paths, see `cythonize_packages`
+    :param module_defs: The modules found in `packages`
+    :param data_patterns: Glob patterns, relative to each package path, e.g. `"templates/*.html"` or `"**/*.json"`
+    :return: Sorted list of owning package name, `/` separated resource name and path to the file
+    """
+    package_names = {
+        module_def.module_name for module_def in module_defs if module_def.is_package
+    }
+
+    data_files: dict[tuple[str, str], Path] = {}
+    for package_paths in packages.values():
+        if isinstance(package_paths, Path):
+            package_paths = [package_paths]
+
+        for package_path in package_paths:
+            if not package_path.is_dir():
+                continue
+
+            for data_pattern in data_patterns:
+                for data_path in package_path.glob(data_pattern):
+                    if not data_path.is_file():
+                        continue
+
+                    if data_path.suffix in {".py", ".pyx", ".pxd"}:
+                        continue
+
+                    parts = data_path.relative_to(package_path.parent).parts
+                    for idx in range(len(parts) - 1, 0, -1):
+                        if (package_name := ".".join(parts[:idx])) in package_names:
+                            resource_name = "/".join(parts[idx:])
+                            data_files.setdefault(
+                                (package_name, resource_name), data_path
+                            )
+                            break
+
+    return [(*key, path) for key, path in sorted(data_files.items())]
+
+
+def build_resource_tree_code(tree: dict) -> str:
+    """
+    :param tree: Nested dict of resource names, leaves are the resource index in `bootstrap.h`
+    :return: Cython expression of a nested dict of read-only `memoryview`s
+    """
+    items = []
+    for name, value in tree.items():
+        if isinstance(value, dict):
+            value_code = build_resource_tree_code(value)
+        else:
+            idx, size = value
+            value_code = (
+                f"PyMemoryView_FromMemory("
+                f"<char*>__cythontools_resource_{idx}, {size}, PyBUF_READ)"
+            )
+        items.append(f"{name!r}: {value_code}")
+
+    return "{" + ", ".join(items) + "}"
+
+
+def build_shard_names(
+    extension_name: str,
+    module_defs: list[ModuleDef],
+    shard_size: int | None = None,
+) -> dict[str, str]:
+    """
+    Assign modules to extension shards, one per top-level subpackage of each root.
+    Modules directly inside a root (and single module roots) stay in the root extension.
+
+    :param extension_name: Final name of the root extension, used as a prefix of the shard names
+    :param module_defs: Cythonized modules
+    :param shard_size: Split the shards further, so each holds at most this many bytes of generated C code, defaults to None
+    :return: Shard name by module name, for the modules which do not stay in the root extension
+    """
+    subpackages: dict[str, list[ModuleDef]] = {}
+    for module_def in sorted(
+        module_defs, key=lambda module_def: module_def.module_name
+    ):
+        parts = module_def.module_name.split(".")
+        if len(parts) < 2 or (len(parts) == 2 and not module_def.is_package):
+            continue
+
+        subpackages.setdefault("_".join(parts[:2]), []).append(module_def)
+
+    shard_names: dict[str, str] = {}
+    for subpackage_name, subpackage_defs in subpackages.items():
+        chunk_idx = 0
+        chunk_size = 0
+        for module_def in subpackage_defs:
+            size = module_def.c_path.stat().st_size
+            if shard_size is not None and chunk_size and chunk_size + size > shard_size:
+                chunk_idx += 1
+                chunk_size = 0
+
+            chunk_size += size
+
+            shard_name = f"{extension_name}__{subpackage_name}"
+            if shard_size is not None:
+                shard_name += f"_{chunk_idx}"
+
+            shard_names[module_def.module_name] = shard_name
+
+    return shard_names
+
+
+def generate_shard(
+    shard_name: str,
+    module_defs: list[ModuleDef],
+    working_path: Path,
+) -> Path:
+    """
+    Generate the entry module of an extension shard.
+    It exports the `PyModuleDef` of each module in the shard as a `PyCapsule`,
+    in its `__cythontools_modules__` dict, for the finder in the root `bootstrap`.
+
+    :param shard_name: Final name of the shard extension
+    :param module_defs: Modules linked into the shard
+    :param working_path: Working path for generated files
+    :return: Path to the generated `*.pyx` file
+    """
+    shard_path = working_path / shard_name
+
+    header_code = (
+        "#undef CYTHON_NO_PYINIT_EXPORT\n"
+        "#ifdef __cplusplus\n"
+        'extern "C" {\n'
+        "#endif // __cplusplus\n"
+    )
+    cython_code = (
+        "from cpython.pycapsule cimport PyCapsule_New\n"
+        "\n"
+        f"cdef extern from '{shard_name}.h':\n"
+    )
+    for module_def in module_defs:
+        header_code += f"    void* {module_def.initializer_name}(void);\n"
+        cython_code += f"    void* {module_def.initializer_name}()\n"
+
+    header_code += "#ifdef __cplusplus\n}\n#endif // __cplusplus\n"
+
+    cython_code += "\n__cythontools_modules__ = {\n"
+    cython_code += "".join(
+        f"    {module_def.module_name!r}: "
+        f"PyCapsule_New({module_def.initializer_name}(), NULL, NULL),\n"
+        for module_def in module_defs
+    )
+    cython_code += "}\n"
+
+    update_file(shard_path.with_suffix(".h"), header_code)
+    update_file(shard_path.with_suffix(".pyx"), cython_code)
+
+    return shard_path.with_suffix(".pyx")
+
+
+RESOURCE_READER_CODE = """\
+    class EmbeddedTraversable:
+        def __init__(self, name, entry):
+            self.name = name
+            self.entry = entry
+
+        def __repr__(self):
+            return f"<EmbeddedTraversable {self.name!r}>"
+
+        def is_dir(self):
+            return isinstance(self.entry, dict)
+
+        def is_file(self):
+            return isinstance(self.entry, memoryview)
+
+        def iterdir(self):
+            if not self.is_dir():
+                raise NotADirectoryError(self.name)
+            return (EmbeddedTraversable(name, entry) for name, entry in self.entry.items())
+
+        def joinpath(self, *descendants):
+            cdef object node = self
+            for descendant in descendants:
+                for name in str(descendant).replace("\\\\", "/").split("/"):
+                    if name in {"", "."}:
+                        continue
+                    entry = node.entry.get(name) if node.is_dir() else None
+                    node = EmbeddedTraversable(name, entry)
+            return node
+
+        __truediv__ = joinpath
+
+        def memoryview(self):
+            if self.is_dir():
+                raise IsADirectoryError(self.name)
+            if self.entry is None:
+                raise FileNotFoundError(self.name)
+            return self.entry
+
+        def read_bytes(self):
+            return bytes(self.memoryview())
+
+        def read_text(self, encoding=None, errors=None):
+            return str(self.memoryview(), encoding or "utf-8", errors or "strict")
+
+        def open(self, mode="r", *args, **kwargs):
+            import io
+
+            stream = io.BytesIO(self.memoryview())
+            if "b" in mode:
+                return stream
+            return io.TextIOWrapper(stream, *args, **kwargs)
+
+    class EmbeddedReader:
+        def __init__(self, name, entries):
+            self.name = name
+            self.entries = entries
+
+        def files(self):
+            return EmbeddedTraversable(self.name, self.entries)
+
+"""
+
+
+def cythonize_packages(
+    extension_name: str,
+    packages: dict[str, list[Path] | Path],
     preprocessors: list[BasePreprocessor] | None = None,
     working_path: Path = Path("./build/generated/"),
+    data_patterns: list[str] | None = None,
     language_level: int = 3,
     annotate_html: bool = False,
     annotate_coverage: bool = False,
     check_timestamps: bool = True,
     verbose: bool = False,
     quiet: bool = False,
+    shard: bool = False,
+    shard_size: int | None = None,
+    deterministic: bool = False,
 ) -> list[ModuleDef]:
     """
-    Cythonize and patch python files in a package.
+    Cythonize and patch python files in one or more packages, which will be bundled in a single extension.
     This includes these main steps (in order):
     1. Run `preprocessors` on the package
     2. Cythonize each module to generate a `*.c` file
@@ -131,6 +450,13 @@ def cythonize_package(
     NOTE:
       Namespace packages are compiled together as if they were a normal package.
 
+    NOTE:
+      Each entry of `packages` is a separate root with its own entry in the generated finder.
+      A root can also be a single module file, e.g. a pure-python third party dependency like `six.py`.
+
+      Only the root named `extension_name` (if any) is executed by `bootstrap`. The other roots
+      are imported through the finder as usual, so the extension must be imported before them.
+
     NOTE:
       Preprocessors are free to cythonize the modules on their own.
       The content of the files is irrelivant, so long as cython can compile it.
@@ -156,6 +482,37 @@ def cythonize_package(
       The `CYTHON_NO_PYINIT_EXPORT` C macro should be defined when compiling all extensions
       except `bootstrap` - it causes their `PyInit_*` functions to be exported, which we don't want.
 
+    NOTE:
+      Files matching `data_patterns` are embedded in `bootstrap.h` as read-only arrays and served
+      through the loader's `get_resource_reader`, e.g. with `importlib.resources.files(package)`.
+
+      The `Traversable`s returned by the reader have a `memoryview()` method, which returns
+      a read-only view of the embedded bytes without copying them.
+
+    NOTE:
+      The generated finder and loader do not derive from `importlib.abc` - importing it
+      pulls in `importlib.resources` and dominates the startup time of the extension.
+
+    NOTE:
+      With `shard=True`, the modules of each top-level subpackage are linked into a separate extension shard
+      (see `build_shard_names` and `generate_shard`) instead of the root extension. Their `ModuleDef.shard_name`
+      is set to the name of the shard, which is installed next to the root extension.
+
+      The finder in `bootstrap` loads a shard with the interpreter's `ExtensionFileLoader` when one
+      of its modules is first imported, so the shard is only mapped once it is needed, and an edit
+      only relinks the shards whose modules changed (and the root extension).
+
+      Shards are located relative to the root extension's `__file__`, so they are not supported in executables.
+
+    NOTE:
+      The modules are sorted by name, so the tables in `bootstrap` (and the link order of the extension)
+      don't depend on the order in which the filesystem lists them.
+
+      With `deterministic=True`, Cython is run from inside `working_path` (see `current_directory`), so the
+      source paths it embeds in the generated C code are relative to it, e.g. `package/module.py`. Identical
+      sources then produce identical bytes on any machine and checkout path. The bundled modules have no
+      `__file__`, their tracebacks only use these paths.
+
     NOTE:
       On import, all submodules have their `ModuleSpec`, `ModuleDef` and `Module` initialized.
       The `Module` contents are not executed until the `Loader` requests their execution.
@@ -164,103 +521,82 @@ def cythonize_package(
       and top-most package, which will be executed as a last step in `bootstrap`.
       The latter will also replace `bootstrap` in `sys.modules`.
 
-    :param package_name: Final name of the package
-    :param package_paths: Path or paths to the package that will be compiled
+    :param extension_name: Final name of the extension
+    :param packages: Mapping from the final name of each root package to the path or paths that will be compiled
     :param preprocessors: List of `BasePreprocessor` to run on the source code before compiling, defaults to None
     :param working_path: Working path for generated files, defaults to Path("./build/generated/")
+    :param data_patterns: Glob patterns of package data files to embed, see `find_data_files`, defaults to None
     :param language_level: Major python version to assume in cython - must be 2 or 3, defaults to 3
     :param annotate_html: Generate html annotations which show python usage after cythonization, defaults to False
     :param annotate_coverage: Include coverage information in annotated html files, defaults to False, implies `annotate_html=True`
     :param check_timestamps: Cythonize only if changes are detected, defaults to True
     :param verbose: Include debug logs, defaults to False
     :param quiet: Do not emit logs, defaults to False
+    :param shard: Link each top-level subpackage into a separate extension shard, defaults to False
+    :param shard_size: Split the shards further by the size of their generated C code, see `build_shard_names`, defaults to None
+    :param deterministic: Embed source paths relative to `working_path` in the generated C code, defaults to False
     :raises ValueError: If both `verbose=True` and `quiet=True`
+    :raises ValueError: If a module is found in more than one root
     :return: List of cythonized `ModuleDef`
     """
 
-    if isinstance(package_paths, Path):
-        package_paths = [package_paths]
-
     if preprocessors is None:
         preprocessors = []
 
+    if data_patterns is None:
+        data_patterns = []
+
     if annotate_coverage:
         annotate_html = True
 
     if verbose and quiet:
         raise ValueError("Verbose and quiet are mutually exclusive.")
 
-    init_count = sum(
-        (package_path / "__init__.py").is_file() for package_path in package_paths
-    )
-
-    if len(package_paths) > 1:
-        assert init_count == 0, "All namespace packages must omit their '__init__.py'"
-
     module_names: set[str] = set()
 
     module_defs: list[ModuleDef] = []
-    for package_path in package_paths:
-        for module_path in package_path.rglob("*.*"):
-            if module_path.suffix not in {".py", ".pyx", ".pxd"}:
-                continue
+    for package_name, package_paths in packages.items():
+        if isinstance(package_paths, Path):
+            package_paths = [package_paths]
+
+        init_count = sum(
+            (package_path / "__init__.py").is_file() for package_path in package_paths
+        )
 
-            relative_path = module_path.relative_to(package_path.parent)
+        if len(package_paths) > 1:
+            assert (
+                init_count == 0
+            ), "All namespace packages must omit their '__init__.py'"
 
-            if is_package := module_path.stem == "__init__":
-                module_name = relative_path.parent
+        package_names: set[str] = set()
+        for package_path in package_paths:
+            if package_path.is_file():
+                module_paths = [package_path]
             else:
-                module_name = relative_path
+                module_paths = package_path.rglob("*.*")
 
-            module_name = (
-                str(module_name.with_suffix(""))
-                .replace("/", ".")
-                .replace("\\", ".")
-                .strip(".")
-            )
+            for module_path in module_paths:
+                if module_path.suffix not in {".py", ".pyx", ".pxd"}:
+                    continue
 
-            if (is_package, module_name) in module_names:
-                continue
+                is_package, module_name = build_module_name(package_path, module_path)
+                if (is_package, module_name) in package_names:
+                    continue
 
-            module_names.add((is_package, module_name))
+                if (is_package, module_name) in module_names:
+                    raise ValueError(f"Module {module_name!r} found in multiple roots")
 
-            initializer_name = build_initializer_name(
-                is_package=is_package, module_name=module_name
-            )
+                package_names.add((is_package, module_name))
 
-            c_path = (working_path / relative_path).with_suffix(".c")
-            c_path.parent.mkdir(parents=True, exist_ok=True)
-
-            py_source = None
-            if (py_path := module_path.with_suffix(".py")) and py_path.exists():
-                py_source = py_path.read_text()
-
-            pyx_source = None
-            if (pyx_path := module_path.with_suffix(".pyx")) and pyx_path.exists():
-                pyx_source = pyx_path.read_text()
-
-            pxd_source = None
-            if (pxd_path := module_path.with_suffix(".pxd")) and pxd_path.exists():
-                pxd_source = pxd_path.read_text()
-
-            module_defs.append(
-                ModuleDef(
-                    is_package=is_package,
-                    module_name=module_name,
-                    initializer_name=initializer_name,
-                    c_path=c_path,
-                    py_source=py_source,
-                    pyx_source=pyx_source,
-                    pxd_source=pxd_source,
+                module_defs.append(
+                    load_module_def(package_path, module_path, working_path)
                 )
-            )
 
-    for idx, module_spec in enumerate(module_defs):
-        if module_spec.module_name == package_name:
-            root_idx = idx
-            break
-    else:
-        root_idx = len(module_defs)
+        module_names |= package_names
+
+        if any(module_def.module_name == package_name for module_def in module_defs):
+            continue
+
         namespace_init_path = working_path / package_name / "__init__.py"
 
         module_defs.append(
@@ -275,13 +611,38 @@ def cythonize_package(
             )
         )
 
+    module_defs.sort(key=lambda module_def: module_def.module_name)
+
+    source_root = working_path.resolve() if deterministic else None
+
+    found_module_defs = module_defs
     for preprocessor in preprocessors:
         module_defs = preprocessor.process_package(module_defs)
 
-    dirty = False
+    # NOTE:
+    #   Files are owned by the innermost package they were found in, even if a preprocessor
+    #   (e.g. `ReachabilityPreprocessor`) dropped it, so they aren't moved to its parent
+    package_names = {
+        module_def.module_name for module_def in module_defs if module_def.is_package
+    }
+    data_files = [
+        data_file
+        for data_file in find_data_files(packages, found_module_defs, data_patterns)
+        if data_file[0] in package_names
+    ]
+
     for module_def in module_defs:
         module_def.save()
 
+    # NOTE:
+    #   Declaration-only modules are saved, so other modules can `cimport` them,
+    #   but they have nothing to compile or bootstrap
+    module_defs = [
+        module_def for module_def in module_defs if not module_def.is_declaration
+    ]
+
+    dirty = False
+    for module_def in module_defs:
         dirty |= cythonize_module(
             module_def,
             language_level=language_level,
@@ -290,26 +651,73 @@ def cythonize_package(
             check_timestamps=check_timestamps,
             verbose=verbose,
             quiet=quiet,
+            source_root=source_root,
+        )
+
+    if shard:
+        shard_names = build_shard_names(extension_name, module_defs, shard_size)
+        module_defs = [
+            dataclasses.replace(
+                module_def, shard_name=shard_names.get(module_def.module_name)
+            )
+            for module_def in module_defs
+        ]
+
+    shard_defs = [
+        ModuleDef(
+            is_package=False,
+            module_name=shard_name,
+            initializer_name=f"PyInit_{shard_name}",
+            c_path=working_path / f"{shard_name}.c",
+            shard_name=shard_name,
+        )
+        for shard_name in dict.fromkeys(
+            module_def.shard_name
+            for module_def in module_defs
+            if module_def.shard_name is not None
         )
+    ]
 
     bootstrap_path = working_path / "bootstrap"
     c_path = bootstrap_path.with_suffix(".c")
     header_path = bootstrap_path.with_suffix(".h")
     cython_path = bootstrap_path.with_suffix(".pyx")
     html_path = bootstrap_path.with_suffix(".html")
+    manifest_path = bootstrap_path.with_suffix(".txt")
+
+    # NOTE:
+    #   Removing a module (or a data file) doesn't make any source newer,
+    #   so the set of modules the bootstrap was generated for is kept next to it
+    manifest = "".join(
+        [
+            *(
+                f"module {module_def.module_name} {module_def.shard_name}\n"
+                for module_def in module_defs
+            ),
+            *(
+                f"resource {package_name} {resource_name}\n"
+                for package_name, resource_name, _ in data_files
+            ),
+        ]
+    )
 
     try:
+        dirty |= manifest_path.read_text() != manifest
         generated_last_modified = max(
             Utils.modification_time(header_path),
             Utils.modification_time(cython_path),
             Utils.modification_time(c_path),
+            *(Utils.modification_time(shard_def.c_path) for shard_def in shard_defs),
         )
         if annotate_html:
             generated_last_modified = max(
                 generated_last_modified, Utils.modification_time(html_path)
             )
         source_last_modified = max(
-            module_def.last_modified for module_def in module_defs
+            [
+                *(module_def.last_modified for module_def in module_defs),
+                *(Utils.modification_time(path) for _, _, path in data_files),
+            ]
         )
         dirty |= not check_timestamps or generated_last_modified < source_last_modified
     except OSError:
@@ -317,14 +725,40 @@ def cythonize_package(
 
     bootstrap_def = ModuleDef(
         is_package=True,
-        module_name=package_name,
-        initializer_name=f"PyInit_{package_name}",
+        module_name=extension_name,
+        initializer_name=f"PyInit_{extension_name}",
         c_path=c_path,
     )
 
     if not dirty:
-        module_defs.append(bootstrap_def)
-        return module_defs
+        return [*module_defs, *shard_defs, bootstrap_def]
+
+    for shard_def in shard_defs:
+        shard_path = generate_shard(
+            shard_def.shard_name,
+            [
+                module_def
+                for module_def in module_defs
+                if module_def.shard_name == shard_def.shard_name
+            ],
+            working_path,
+        )
+
+        with current_directory(source_root):
+            compile(
+                str(shard_path.resolve()),
+                full_module_name=shard_def.module_name,
+                output_file=shard_def.c_path.resolve(),
+                module_name=shard_def.module_name,
+                language_level=language_level,
+                timestamps=check_timestamps,
+                verbose=verbose,
+                quiet=quiet,
+            )
+
+    root_module_defs = [
+        module_def for module_def in module_defs if module_def.shard_name is None
+    ]
 
     finder_name = "MyMetaFinder"
     loader_name = "MyLoader"
@@ -336,34 +770,65 @@ def cythonize_package(
         'extern "C" {\n'
         "#endif // __cplusplus\n"
     )
-    for spec in module_defs:
+    for spec in root_module_defs:
         header_code += f"    void* {spec.initializer_name}(void);\n"
         cython_code += f"    void* {spec.initializer_name}()\n"
 
+    resource_trees: dict[str, dict] = {}
+    for idx, (package_name, resource_name, data_path) in enumerate(data_files):
+        data = data_path.read_bytes()
+        values = ",\n".join(
+            ",".join(map(str, data[start : start + 64]))
+            for start in range(0, len(data), 64)
+        )
+        header_code += (
+            f"    static const unsigned char __cythontools_resource_{idx}[] = {{\n"
+            f"{values or '0'}\n"
+            f"    }};\n"
+        )
+        cython_code += f"    const unsigned char __cythontools_resource_{idx}[]\n"
+
+        *dir_names, file_name = resource_name.split("/")
+        tree = resource_trees.setdefault(package_name, {})
+        for dir_name in dir_names:
+            tree = tree.setdefault(dir_name, {})
+        tree[file_name] = (idx, len(data))
+
     header_code += "#ifdef __cplusplus\n}\n#endif // __cplusplus\n"
 
+    shard_lookup_code = ""
+    if shard_defs:
+        shard_lookup_code = (
+            "            if module_info is None:\n"
+            "                module_info = load_shard_module(fullname)\n"
+        )
+
     cython_code += (
+        f"\n"
+        f"from cpython.pycapsule cimport PyCapsule_GetPointer\n"
         f"\n"
         f"cdef extern from 'Python.h':\n"
         f"    object PyModule_FromDefAndSpec(void* module_def, object spec)\n"
         f"    int PyModule_ExecDef(object module, void* module_def)\n"
         f"    void* PyModule_GetDef(object module)\n"
+        f"    object PyMemoryView_FromMemory(char* mem, Py_ssize_t size, int flags)\n"
+        f"    int PyBUF_READ\n"
         f"\n"
         f"cdef void bootstrap():\n"
         f"    import sys\n"
         f"\n"
-        f"    from importlib.abc import Loader, MetaPathFinder\n"
         f"    from importlib.machinery import ModuleSpec\n"
         f"\n"
-        f"    class {finder_name}(MetaPathFinder):\n"
+        f"    class {finder_name}:\n"
         f"        @classmethod\n"
         f"        def find_spec(cls, fullname not None, path, target=None):\n"
         f"            cdef tuple module_info = module_infos.get(fullname)\n"
+        f"{shard_lookup_code}"
         f"            if module_info is None:\n"
         f"                return None\n"
         f"            return module_info[0]\n"
         f"\n"
-        f"    class {loader_name}(Loader):\n"
+        f"    class {loader_name}:\n"
         f"        @classmethod\n"
         f"        def get_code(cls, fullname not None):\n"
         f"            return (\n"
@@ -388,7 +853,71 @@ def cythonize_package(
         f"            PyModule_ExecDef(module, PyModule_GetDef(module))\n"
         f"\n"
     )
-    for idx, spec in enumerate(module_defs):
+
+    if resource_trees:
+        cython_code += (
+            "        @classmethod\n"
+            "        def get_resource_reader(cls, fullname not None):\n"
+            "            cdef tuple module_info = module_infos.get(fullname)\n"
+            "            if module_info is None:\n"
+            "                return None\n"
+            "            if module_info[0].submodule_search_locations is None:\n"
+            "                fullname = fullname.rpartition('.')[0]\n"
+            "            return EmbeddedReader(fullname, resource_infos.get(fullname, {}))\n"
+            "\n"
+        )
+        cython_code += RESOURCE_READER_CODE
+        cython_code += "    cdef dict resource_infos = {\n"
+        cython_code += "".join(
+            f"        {package_name!r}: {build_resource_tree_code(tree)},\n"
+            for package_name, tree in resource_trees.items()
+        )
+        cython_code += "    }\n\n"
+    if shard_defs:
+        cython_code += (
+            f"    import os\n"
+            f"\n"
+            f"    from importlib.machinery import ExtensionFileLoader\n"
+            f"\n"
+            f"    cdef str shard_directory = os.path.dirname(__file__)\n"
+            f"    cdef str shard_suffix = os.path.basename(__file__)[{len(extension_name)}:]\n"
+            f"    cdef dict shards = {{}}\n"
+            f"    cdef dict shard_infos = {{\n"
+        )
+        cython_code += "".join(
+            f"        {module_def.module_name!r}: "
+            f"({module_def.shard_name!r}, {module_def.is_package}),\n"
+            for module_def in module_defs
+            if module_def.shard_name is not None
+        )
+        cython_code += (
+            f"    }}\n"
+            f"\n"
+            f"    def load_shard_module(fullname):\n"
+            f"        cdef tuple shard_info = shard_infos.get(fullname)\n"
+            f"        if shard_info is None:\n"
+            f"            return None\n"
+            f"        shard_name, is_package = shard_info\n"
+            f"        shard = shards.get(shard_name)\n"
+            f"        if shard is None:\n"
+            f"            shard_file = os.path.join(shard_directory, shard_name + shard_suffix)\n"
+            f"            shard_loader = ExtensionFileLoader(shard_name, shard_file)\n"
+            f"            shard = shard_loader.create_module(\n"
+            f"                ModuleSpec(shard_name, shard_loader, origin=shard_file)\n"
+            f"            )\n"
+            f"            shard_loader.exec_module(shard)\n"
+            f"            shards[shard_name] = shard\n"
+            f"        spec = ModuleSpec(fullname, {loader_name}, is_package=is_package)\n"
+            f"        module = PyModule_FromDefAndSpec(\n"
+            f"            PyCapsule_GetPointer(shard.__cythontools_modules__[fullname], NULL), spec\n"
+            f"        )\n"
+            f"        cdef tuple module_info = (spec, module)\n"
+            f"        module_infos[fullname] = module_info\n"
+            f"        return module_info\n"
+            f"\n"
+        )
+
+    for idx, spec in enumerate(root_module_defs):
         cython_code += (
             f"    cdef str name_{idx} = {spec.module_name!r}\n"
             f"    cdef object spec_{idx} = ModuleSpec(name_{idx}, {loader_name}, is_package={spec.is_package})\n"
@@ -400,32 +929,385 @@ def cythonize_package(
     cython_code += "    cdef dict module_infos = {\n"
     cython_code += "".join(
         f"        name_{idx}: (spec_{idx}, module_{idx}),\n"
-        for idx, _ in enumerate(module_defs)
+        for idx, _ in enumerate(root_module_defs)
     )
     cython_code += "    }\n\n"
-    cython_code += (
-        f"    sys.meta_path.insert(0, {finder_name})\n"
-        f"    sys.modules[name_{root_idx}] = module_{root_idx}\n"
-        f"    PyModule_ExecDef(module_{root_idx}, module_def_{root_idx})\n"
-    )
+    cython_code += f"    sys.meta_path.insert(0, {finder_name})\n"
+    for idx, spec in enumerate(root_module_defs):
+        if spec.module_name != extension_name:
+            continue
+
+        cython_code += (
+            f"    sys.modules[name_{idx}] = module_{idx}\n"
+            f"    module_{idx}.__spec__ = spec_{idx}\n"
+            f"    PyModule_ExecDef(module_{idx}, module_def_{idx})\n"
+        )
 
     cython_code += "bootstrap()\n"
 
-    header_path.write_text(header_code)
-    cython_path.write_text(cython_code)
+    # NOTE:
+    #   Unchanged files keep their modification time, so the bootstrap isn't recompiled after each edit.
+    #   The header isn't a dependency Cython knows of, but the embedded data may change on its own
+    header_changed = update_file(header_path, header_code)
+    update_file(cython_path, cython_code)
+
+    with current_directory(source_root):
+        compile(
+            str(cython_path.resolve()),
+            full_module_name=extension_name,
+            output_file=c_path.resolve(),
+            module_name=extension_name,
+            language_level=language_level,
+            annotate=annotate_html,
+            annotate_coverage_xml=annotate_coverage,
+            timestamps=check_timestamps and not header_changed,
+            verbose=verbose,
+            quiet=quiet,
+        )
+
+    update_file(manifest_path, manifest)
+
+    return [*module_defs, *shard_defs, bootstrap_def]
+
 
-    compile(
-        str(cython_path),
-        full_module_name=package_name,
-        output_file=c_path,
-        module_name=package_name,
+def cythonize_package(
+    package_name: str,
+    package_paths: list[Path] | Path,
+    preprocessors: list[BasePreprocessor] | None = None,
+    working_path: Path = Path("./build/generated/"),
+    data_patterns: list[str] | None = None,
+    language_level: int = 3,
+    annotate_html: bool = False,
+    annotate_coverage: bool = False,
+    check_timestamps: bool = True,
+    verbose: bool = False,
+    quiet: bool = False,
+    deterministic: bool = False,
+) -> list[ModuleDef]:
+    """
+    Cythonize and patch python files in a package.
+    Shorthand for `cythonize_packages` with a single root named after the extension.
+
+    :param package_name: Final name of the package
+    :param package_paths: Path or paths to the package that will be compiled
+    :param preprocessors: List of `BasePreprocessor` to run on the source code before compiling, defaults to None
+    :param working_path: Working path for generated files, defaults to Path("./build/generated/")
+    :param data_patterns: Glob patterns of package data files to embed, see `find_data_files`, defaults to None
+    :param language_level: Major python version to assume in cython - must be 2 or 3, defaults to 3
+    :param annotate_html: Generate html annotations which show python usage after cythonization, defaults to False
+    :param annotate_coverage: Include coverage information in annotated html files, defaults to False, implies `annotate_html=True`
+    :param check_timestamps: Cythonize only if changes are detected, defaults to True
+    :param verbose: Include debug logs, defaults to False
+    :param quiet: Do not emit logs, defaults to False
+    :param deterministic: Embed source paths relative to `working_path` in the generated C code, defaults to False
+    :raises ValueError: If both `verbose=True` and `quiet=True`
+    :return: List of cythonized `ModuleDef`
+    """
+
+    return cythonize_packages(
+        extension_name=package_name,
+        packages={package_name: package_paths},
+        preprocessors=preprocessors,
+        working_path=working_path,
+        data_patterns=data_patterns,
         language_level=language_level,
-        annotate=annotate_html,
-        annotate_coverage_xml=annotate_coverage,
-        timestamps=check_timestamps,
+        annotate_html=annotate_html,
+        annotate_coverage=annotate_coverage,
+        check_timestamps=check_timestamps,
         verbose=verbose,
         quiet=quiet,
+        deterministic=deterministic,
+    )
+
+
+def generate_executable_main(
+    extension_name: str,
+    main_module: str,
+    working_path: Path = Path("./build/generated/"),
+    isolated: bool = False,
+    site_import: bool = True,
+    home: str | None = None,
+) -> Path:
+    """
+    Generate the `main.c` of an executable which embeds the interpreter and a bundled extension.
+
+    The extension is registered as a builtin module via `PyImport_AppendInittab`, so importing it
+    does not search `sys.path`. The executable then imports `main_module` and calls its
+    `__cythontools_main__` function, with `sys.argv` set to the executable's arguments.
+
+    NOTE:
+      The bootstrap's `PyInit_*` must be linked into the executable, which is why the generated
+      `bootstrap.h` undefines `CYTHON_NO_PYINIT_EXPORT`.
+
+    :param extension_name: Name of the bundled extension, see `cythonize_packages`
+    :param main_module: Module whose `__cythontools_main__` is the entry point
+    :param working_path: Working path for generated files, defaults to Path("./build/generated/")
+    :param isolated: Initialize the interpreter with an isolated config, i.e. ignore the environment and user site-packages, defaults to False
+    :param site_import: Import `site` on startup, defaults to True
+    :param home: Python home of the embedded interpreter, defaults to None, i.e. computed from the executable path
+    :return: Path to the generated `main.c`
+    """
+
+    config_init = (
+        "PyConfig_InitIsolatedConfig" if isolated else "PyConfig_InitPythonConfig"
+    )
+
+    home_code = ""
+    if home is not None:
+        home_literal = home.replace("\\", "\\\\").replace('"', '\\"')
+        home_code = (
+            f'    status = PyConfig_SetBytesString(&config, &config.home, "{home_literal}");\n'
+            f"    if (PyStatus_Exception(status)) {{\n"
+            f"        goto fail;\n"
+            f"    }}\n"
+            f"\n"
+        )
+
+    main_code = (
+        f"#define PY_SSIZE_T_CLEAN\n"
+        f"#include <Python.h>\n"
+        f"\n"
+        f"PyMODINIT_FUNC PyInit_{extension_name}(void);\n"
+        f"\n"
+        f"int main(int argc, char** argv) {{\n"
+        f"    PyStatus status;\n"
+        f"    PyConfig config;\n"
+        f"    {config_init}(&config);\n"
+        f"    config.parse_argv = 0;\n"
+        f"    config.site_import = {int(site_import)};\n"
+        f"\n"
+        f"{home_code}"
+        f"    status = PyConfig_SetBytesArgv(&config, argc, argv);\n"
+        f"    if (PyStatus_Exception(status)) {{\n"
+        f"        goto fail;\n"
+        f"    }}\n"
+        f"\n"
+        f'    if (PyImport_AppendInittab("{extension_name}", PyInit_{extension_name}) == -1) {{\n'
+        f'        status = PyStatus_Error("Could not register {extension_name}");\n'
+        f"        goto fail;\n"
+        f"    }}\n"
+        f"\n"
+        f"    status = Py_InitializeFromConfig(&config);\n"
+        f"    if (PyStatus_Exception(status)) {{\n"
+        f"        goto fail;\n"
+        f"    }}\n"
+        f"    PyConfig_Clear(&config);\n"
+        f"\n"
+        f"    int exit_code = 0;\n"
+        f"    PyObject* result = NULL;\n"
+        f'    PyObject* extension = PyImport_ImportModule("{extension_name}");\n'
+        f'    PyObject* module = extension ? PyImport_ImportModule("{main_module}") : NULL;\n'
+        f'    PyObject* entry = module ? PyObject_GetAttrString(module, "__cythontools_main__") : NULL;\n'
+        f"    if (entry != NULL) {{\n"
+        f"        result = PyObject_CallNoArgs(entry);\n"
+        f"    }}\n"
+        f"\n"
+        f"    if (result == NULL) {{\n"
+        f"        PyErr_Print();\n"
+        f"        exit_code = 1;\n"
+        f"    }}\n"
+        f"\n"
+        f"    Py_XDECREF(result);\n"
+        f"    Py_XDECREF(entry);\n"
+        f"    Py_XDECREF(module);\n"
+        f"    Py_XDECREF(extension);\n"
+        f"\n"
+        f"    if (Py_FinalizeEx() < 0) {{\n"
+        f"        exit_code = 120;\n"
+        f"    }}\n"
+        f"    return exit_code;\n"
+        f"\n"
+        f"fail:\n"
+        f"    PyConfig_Clear(&config);\n"
+        f"    Py_ExitStatusException(status);\n"
+        f"}}\n"
+    )
+
+    main_path = working_path / "main.c"
+    main_path.parent.mkdir(parents=True, exist_ok=True)
+    update_file(main_path, main_code)
+    return main_path
+
+
+# NOTE:
+#   Microarchitecture levels of the x86-64 psABI, with the CPU features checked at runtime.
+#   Only the features known to `__builtin_cpu_supports` of older GCC/Clang versions are checked,
+#   which is enough to tell the levels apart on real hardware.
+CPU_LEVELS: dict[str, list[str]] = {
+    "x86-64": [],
+    "x86-64-v2": ["popcnt", "sse3", "ssse3", "sse4.1", "sse4.2"],
+    "x86-64-v3": [
+        *("popcnt", "sse3", "ssse3", "sse4.1", "sse4.2"),
+        *("avx", "avx2", "bmi", "bmi2", "fma"),
+    ],
+    "x86-64-v4": [
+        *("popcnt", "sse3", "ssse3", "sse4.1", "sse4.2"),
+        *("avx", "avx2", "bmi", "bmi2", "fma"),
+        *("avx512f", "avx512bw", "avx512cd", "avx512dq", "avx512vl"),
+    ],
+}
+
+
+def build_variant_name(extension_name: str, cpu_level: str) -> str:
+    return f"{extension_name}__{cpu_level.replace('-', '_')}"
+
+
+def generate_cpu_dispatcher(
+    extension_name: str,
+    cpu_levels: list[str],
+    working_path: Path = Path("./build/generated/"),
+) -> Path:
+    """
+    Generate the `dispatch.c` of an extension which forwards its `PyInit_*` to the best variant for the CPU.
+
+    Each variant is the same bundled extension compiled for a different level in `CPU_LEVELS`,
+    installed next to the dispatcher as `build_variant_name(extension_name, cpu_level)`.
+    The dispatcher picks the first supported level from `cpu_levels` (the best one first), loads the
+    variant and returns the result of its `PyInit_{extension_name}`, so the interpreter initializes
+    the module as if it had loaded the variant directly.
+
+    NOTE:
+      The `CYTHONTOOLS_CPU_LEVEL` environment variable overrides the detection, e.g. to test the
+      baseline variant on a newer CPU. It is not checked against the CPU, so a level which is
+      not supported will crash with an illegal instruction.
+
+    NOTE:
+      The CPU detection relies on `__builtin_cpu_supports`, with other compilers (or on other
+      architectures) only the baseline `x86-64` variant is ever selected.
+
+    :param extension_name: Name of the bundled extension, see `cythonize_packages`
+    :param cpu_levels: Levels from `CPU_LEVELS` that the extension was compiled for
+    :param working_path: Working path for generated files, defaults to Path("./build/generated/")
+    :raises ValueError: If a level is not in `CPU_LEVELS`
+    :return: Path to the generated `dispatch.c`
+    """
+    for cpu_level in cpu_levels:
+        if cpu_level not in CPU_LEVELS:
+            raise ValueError(f"Unknown CPU level {cpu_level!r}")
+
+    levels = list(CPU_LEVELS)
+    cpu_levels = sorted(set(cpu_levels), key=levels.index, reverse=True)
+
+    level_names = ", ".join(f'"{cpu_level}"' for cpu_level in cpu_levels)
+    variant_names = ", ".join(
+        f'"{build_variant_name(extension_name, cpu_level)}"' for cpu_level in cpu_levels
+    )
+
+    supports_code = ""
+    for idx, cpu_level in enumerate(cpu_levels):
+        features = " && ".join(
+            f'__builtin_cpu_supports("{feature}")' for feature in CPU_LEVELS[cpu_level]
+        )
+        supports_code += f"    case {idx}:\n        return {features or '1'};\n"
+
+    baseline_idx = cpu_levels.index("x86-64") if "x86-64" in cpu_levels else -1
+
+    dispatch_code = (
+        f"#define _GNU_SOURCE\n"
+        f"#define PY_SSIZE_T_CLEAN\n"
+        f"#include <Python.h>\n"
+        f"#include <stdlib.h>\n"
+        f"#include <string.h>\n"
+        f"\n"
+        f"#ifdef _WIN32\n"
+        f"#include <windows.h>\n"
+        f"#define PATH_SEPARATOR '\\\\'\n"
+        f"#else\n"
+        f"#include <dlfcn.h>\n"
+        f"#define PATH_SEPARATOR '/'\n"
+        f"#endif\n"
+        f"\n"
+        f"typedef PyObject* (*initializer_t)(void);\n"
+        f"\n"
+        f"static const char* const cpu_levels[] = {{{level_names}}};\n"
+        f"static const char* const variant_names[] = {{{variant_names}}};\n"
+        f"\n"
+        f"static int cpu_supports(int idx) {{\n"
+        f"#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))\n"
+        f"    __builtin_cpu_init();\n"
+        f"    switch (idx) {{\n"
+        f"{supports_code}"
+        f"    }}\n"
+        f"    return 0;\n"
+        f"#else\n"
+        f"    return idx == {baseline_idx};\n"
+        f"#endif\n"
+        f"}}\n"
+        f"\n"
+        f"PyMODINIT_FUNC PyInit_{extension_name}(void) {{\n"
+        f'    const char* override = getenv("CYTHONTOOLS_CPU_LEVEL");\n'
+        f"    if (override != NULL && override[0] == '\\0') {{\n"
+        f"        override = NULL;\n"
+        f"    }}\n"
+        f"\n"
+        f"    int selected = -1;\n"
+        f"    for (int idx = 0; idx < {len(cpu_levels)} && selected < 0; idx++) {{\n"
+        f"        if (override != NULL ? strcmp(override, cpu_levels[idx]) == 0 : cpu_supports(idx)) {{\n"
+        f"            selected = idx;\n"
+        f"        }}\n"
+        f"    }}\n"
+        f"\n"
+        f"    if (selected < 0) {{\n"
+        f"        if (override != NULL) {{\n"
+        f'            PyErr_Format(PyExc_ImportError, "{extension_name} was not built for CPU level %s", override);\n'
+        f"        }} else {{\n"
+        f'            PyErr_SetString(PyExc_ImportError, "{extension_name} was not built for this CPU");\n'
+        f"        }}\n"
+        f"        return NULL;\n"
+        f"    }}\n"
+        f"\n"
+        f"    char path[4096];\n"
+        f"#ifdef _WIN32\n"
+        f"    HMODULE self = NULL;\n"
+        f"    if (!GetModuleHandleExA(\n"
+        f"            GET_MODULE_HANDLE_EX_FLAG_FROM_ADDRESS | GET_MODULE_HANDLE_EX_FLAG_UNCHANGED_REFCOUNT,\n"
+        f"            (LPCSTR)&PyInit_{extension_name}, &self) ||\n"
+        f"        !GetModuleFileNameA(self, path, sizeof(path))) {{\n"
+        f'        PyErr_SetString(PyExc_ImportError, "Could not locate {extension_name}");\n'
+        f"        return NULL;\n"
+        f"    }}\n"
+        f"#else\n"
+        f"    Dl_info info;\n"
+        f"    if (!dladdr((void*)&PyInit_{extension_name}, &info) || info.dli_fname == NULL ||\n"
+        f"        strlen(info.dli_fname) >= sizeof(path)) {{\n"
+        f'        PyErr_SetString(PyExc_ImportError, "Could not locate {extension_name}");\n'
+        f"        return NULL;\n"
+        f"    }}\n"
+        f"    strcpy(path, info.dli_fname);\n"
+        f"#endif\n"
+        f"\n"
+        f"    // NOTE: The variant has the same suffix as the dispatcher, e.g. `.cpython-313-x86_64-linux-gnu.so`\n"
+        f"    char* separator = strrchr(path, PATH_SEPARATOR);\n"
+        f"    char* name = separator != NULL ? separator + 1 : path;\n"
+        f"    char suffix[256];\n"
+        f'    if (snprintf(suffix, sizeof(suffix), "%s", name + {len(extension_name)}) >= (int)sizeof(suffix) ||\n'
+        f'        snprintf(name, sizeof(path) - (name - path), "%s%s", variant_names[selected], suffix) >=\n'
+        f"            (int)(sizeof(path) - (name - path))) {{\n"
+        f'        PyErr_SetString(PyExc_ImportError, "Path of {extension_name} is too long");\n'
+        f"        return NULL;\n"
+        f"    }}\n"
+        f"\n"
+        f"#ifdef _WIN32\n"
+        f"    HMODULE handle = LoadLibraryA(path);\n"
+        f'    initializer_t initializer = handle ? (initializer_t)GetProcAddress(handle, "PyInit_{extension_name}") : NULL;\n'
+        f"    if (initializer == NULL) {{\n"
+        f'        PyErr_Format(PyExc_ImportError, "Could not load %s", path);\n'
+        f"        return NULL;\n"
+        f"    }}\n"
+        f"#else\n"
+        f"    void* handle = dlopen(path, RTLD_NOW | RTLD_LOCAL);\n"
+        f'    initializer_t initializer = handle ? (initializer_t)dlsym(handle, "PyInit_{extension_name}") : NULL;\n'
+        f"    if (initializer == NULL) {{\n"
+        f'        PyErr_Format(PyExc_ImportError, "Could not load %s: %s", path, dlerror());\n'
+        f"        return NULL;\n"
+        f"    }}\n"
+        f"#endif\n"
+        f"\n"
+        f"    return initializer();\n"
+        f"}}\n"
     )
 
-    module_defs.append(bootstrap_def)
-    return module_defs
+    dispatch_path = working_path / "dispatch.c"
+    dispatch_path.parent.mkdir(parents=True, exist_ok=True)
+    update_file(dispatch_path, dispatch_code)
+    return dispatch_path
@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import sys
+import sysconfig
+import functools
+import dataclasses
+
+from pathlib import Path
+from setuptools import Distribution, Extension
+from dataclasses import dataclass
+from importlib.abc import MetaPathFinder
+from importlib.machinery import ModuleSpec, ExtensionFileLoader
+from importlib.resources.abc import Traversable, TraversableResources
+from importlib.resources.readers import MultiplexedPath
+
+from cythontools.package.common import ModuleDef, needs_update, update_file
+from cythontools.package.core import (
+    build_module_name,
+    cythonize_module,
+    load_module_def,
+)
+from cythontools.package.builder import CythonBuilder, IncrementalBuildExt
+from cythontools.package.preprocessors import ReachabilityPreprocessor
+
+
+class DevResourceReader(TraversableResources):
+    """
+    Reads the resources of a package from its source directories rather than from `working_path`,
+    which only holds the generated sources and the extensions.
+    """
+
+    def __init__(self, resource_paths: list[str]):
+        self.resource_paths = resource_paths
+
+    def files(self) -> Traversable:
+        if len(self.resource_paths) == 1:
+            return Path(self.resource_paths[0])
+
+        return MultiplexedPath(*self.resource_paths)
+
+
+class DevExtensionFileLoader(ExtensionFileLoader):
+    """
+    An `ExtensionFileLoader` whose resource reader is backed by the source directories of the package.
+    """
+
+    def __init__(self, fullname: str, path: str, resource_paths: list[str]):
+        super().__init__(fullname, path)
+        self.resource_paths = resource_paths
+
+    def get_resource_reader(self, fullname: str) -> DevResourceReader:
+        return DevResourceReader(self.resource_paths)
+
+
+@dataclass(frozen=True, kw_only=True)
+class DevMetaFinder(MetaPathFinder):
+    """
+    A `MetaPathFinder` which cythonizes and compiles modules of a package when they are first imported.
+
+    Unlike `cythonize_package`, each module is compiled into its own extension in `working_path`
+    and loaded with the interpreter's `ExtensionFileLoader`. The extensions are cached, so subsequent imports
+    only recompile the modules whose sources (or the `*.pxd` files they cimport) have changed.
+
+    NOTE:
+      The modules keep their `PyInit_*` functions, since each of them is a standalone extension.
+      No `bootstrap` is generated and `CYTHON_NO_PYINIT_EXPORT` is not defined.
+
+    NOTE:
+      Directories without an `__init__.py/.pyx` are imported as namespace packages.
+
+    NOTE:
+      Packages are compiled into `<package>/__init__.<suffix>`, like a regular package would be laid out.
+      Resources are read from the source directories, see `DevResourceReader`.
+    """
+
+    builder: CythonBuilder
+    package_name: str
+    package_paths: list[Path]
+    build_temp: Path = Path("./build/temp/")
+
+    @property
+    def working_path(self) -> Path:
+        # NOTE:
+        #   Kept apart from the bundled build, which compiles the same modules
+        #   with different initializer names into the same `c_path`s
+        return self.builder.working_path / "dev"
+
+    def find_module_path(self, fullname: str) -> tuple[Path, Path] | None:
+        relative_path = Path(*fullname.split("."))
+        for package_path in self.package_paths:
+            module_path = package_path.parent / relative_path
+            for suffix in (".py", ".pyx"):
+                if (init_path := module_path / f"__init__{suffix}").is_file():
+                    return package_path, init_path
+
+                if (file_path := module_path.with_suffix(suffix)).is_file():
+                    return package_path, file_path
+
+        return None
+
+    def find_namespace_paths(self, fullname: str) -> list[str]:
+        relative_path = Path(*fullname.split("."))
+        return [
+            str(package_path.parent / relative_path)
+            for package_path in self.package_paths
+            if (package_path.parent / relative_path).is_dir()
+        ]
+
+    @functools.cached_property
+    def dependency_context(self):
+        from Cython.Compiler.Main import CompilationOptions, Context, default_options
+
+        return Context(
+            [str(package_path.parent) for package_path in self.package_paths],
+            {},
+            options=CompilationOptions(default_options),
+        )
+
+    def find_extension_path(self, package_path: Path, module_path: Path) -> Path:
+        relative_path = module_path.relative_to(package_path.parent)
+        return (
+            self.working_path
+            / relative_path.parent
+            / f"{relative_path.stem}{sysconfig.get_config_var('EXT_SUFFIX')}"
+        )
+
+    def is_cached(self, module_path: Path, extension_path: Path) -> bool:
+        """
+        Whether the extension is newer than the sources of the module and the `*.pxd` files it cimports.
+        The cimports are found by `Cython.Build.Dependencies`, without cythonizing the module.
+        """
+        from Cython.Build.Dependencies import DependencyTree
+
+        if not self.builder.check_timestamps or not extension_path.exists():
+            return False
+
+        # NOTE: A new tree for each module, since it caches the modification times
+        dependency_tree = DependencyTree(self.dependency_context, quiet=True)
+
+        dependency_paths = [
+            Path(dependency_path)
+            for suffix in (".py", ".pyx")
+            if (source_path := module_path.with_suffix(suffix)).exists()
+            for dependency_path in dependency_tree.all_dependencies(str(source_path))
+        ]
+        return not needs_update(dependency_paths, [extension_path])
+
+    def save_declarations(self):
+        """
+        Copies the `*.pxd` files of the package into `working_path`, so the compiled module
+        can `cimport` its siblings before they were imported (and compiled) themselves.
+        """
+        for package_path in self.package_paths:
+            for pxd_path in package_path.rglob("*.pxd"):
+                relative_path = pxd_path.relative_to(package_path.parent)
+                working_pxd_path = self.working_path / relative_path
+                working_pxd_path.parent.mkdir(parents=True, exist_ok=True)
+                update_file(working_pxd_path, pxd_path.read_text())
+
+    def compile_module(self, module_def: ModuleDef) -> Path:
+        self.save_declarations()
+
+        for preprocessor in self.builder.preprocessors:
+            # NOTE: The module is being imported, so it is reachable, but its siblings aren't processed with it
+            if isinstance(preprocessor, ReachabilityPreprocessor):
+                continue
+
+            (module_def,) = preprocessor.process_package([module_def])
+
+        module_def.save()
+
+        cythonize_module(
+            module_def,
+            language_level=self.builder.language_level,
+            annotate_html=self.builder.annotate_html,
+            annotate_coverage=self.builder.annotate_coverage,
+            check_timestamps=self.builder.check_timestamps,
+            verbose=self.builder.verbose,
+            quiet=self.builder.quiet,
+        )
+
+        # NOTE: Placed in the package's directory, the initializer is still named after the package
+        extension = Extension(
+            (
+                f"{module_def.module_name}.__init__"
+                if module_def.is_package
+                else module_def.module_name
+            ),
+            [str(module_def.c_path)],
+            export_symbols=[module_def.initializer_name],
+        )
+        distribution = Distribution(
+            {"name": module_def.module_name, "ext_modules": [extension]}
+        )
+
+        command = IncrementalBuildExt(distribution)
+        command.build_lib = str(self.working_path)
+        command.build_temp = str(self.build_temp)
+        command.force = not self.builder.check_timestamps
+        command.verbose = self.builder.verbose
+        command.ensure_finalized()
+        command.run()
+
+        return Path(command.get_ext_fullpath(extension.name))
+
+    def find_spec(self, fullname: str, path, target=None) -> ModuleSpec | None:
+        if fullname != self.package_name and not fullname.startswith(
+            f"{self.package_name}."
+        ):
+            return None
+
+        if (found := self.find_module_path(fullname)) is None:
+            if not (namespace_paths := self.find_namespace_paths(fullname)):
+                return None
+
+            spec = ModuleSpec(fullname, None, is_package=True)
+            spec.submodule_search_locations = namespace_paths
+            return spec
+
+        package_path, module_path = found
+        is_package, _ = build_module_name(package_path, module_path)
+
+        # NOTE: Cached extensions are loaded without running the preprocessors or setuptools
+        extension_path = self.find_extension_path(package_path, module_path)
+        if not self.is_cached(module_path, extension_path):
+            module_def = load_module_def(package_path, module_path, self.working_path)
+
+            # NOTE:
+            #   The initializer is renamed back to the name the interpreter expects,
+            #   which makes the rename in `cythonize_module` a no-op
+            module_def = dataclasses.replace(
+                module_def, initializer_name=f"PyInit_{fullname.rpartition('.')[2]}"
+            )
+
+            extension_path = self.compile_module(module_def)
+
+            # NOTE: Up to date with the sources now, even if they were only touched and nothing was rebuilt
+            extension_path.touch()
+
+        resource_paths = self.find_namespace_paths(
+            fullname if is_package else fullname.rpartition(".")[0]
+        )
+
+        spec = ModuleSpec(
+            fullname,
+            DevExtensionFileLoader(fullname, str(extension_path), resource_paths),
+            origin=str(extension_path),
+            is_package=is_package,
+        )
+        spec.has_location = True
+        if is_package:
+            spec.submodule_search_locations = resource_paths
+
+        return spec
+
+
+def install_dev_finder(
+    package_name: str,
+    package_paths: list[Path] | Path,
+    builder: CythonBuilder | None = None,
+    build_temp: Path = Path("./build/temp/"),
+) -> DevMetaFinder:
+    """
+    Inserts a `DevMetaFinder` at the front of `sys.meta_path`.
+    Meant to be called from a `conftest.py` or similar, before the package is imported.
+
+    :param package_name: Final name of the package
+    :param package_paths: Path or paths to the package that will be compiled on demand
+    :param builder: `CythonBuilder` providing the preprocessors and options, defaults to None
+    :param build_temp: Path for intermediate object files, defaults to Path("./build/temp/")
+    :return: The installed finder
+    """
+
+    if isinstance(package_paths, Path):
+        package_paths = [package_paths]
+
+    if builder is None:
+        builder = CythonBuilder()
+
+    finder = DevMetaFinder(
+        builder=builder,
+        package_name=package_name,
+        package_paths=package_paths,
+        build_temp=build_temp,
+    )
+    sys.meta_path.insert(0, finder)
+    return finder
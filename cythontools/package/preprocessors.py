@@ -12,13 +12,20 @@ TODO@Daniel:
 
 from __future__ import annotations
 
+import fnmatch
+import functools
+
 from typing import Protocol
+from pathlib import Path
 from dataclasses import dataclass, field
 
 from cythontools.package.common import ModuleDef
 
 
-def default_preprocessors() -> list[BasePreprocessor]:
+def default_preprocessors(release: bool = False) -> list[BasePreprocessor]:
+    if release:
+        return [MainPreprocessor(), OptimizingPreprocessor()]
+
     return [MainPreprocessor()]
 
 
@@ -50,9 +57,11 @@ class SourceEditor:
 
     def build(self):
         source_lines = self.source.splitlines(keepends=True)
-        ranges: list[CodeRange] = sorted(self.ranges)
+        ranges: list[CodeRange] = sorted(
+            self.ranges, key=lambda range: (range.start, range.stop)
+        )
         for a, b in zip(ranges[:-1], ranges[1:]):
-            if a.stop < b.start:
+            if b.start < a.stop:
                 raise ValueError("Overlapping code ranges are not allowed.")
 
         code = ""
@@ -81,6 +90,108 @@ class SourceEditor:
         return code
 
 
+@dataclass(frozen=True, kw_only=True)
+class LogicalLine:
+    start_line: int
+    start_col: int
+    stop_line: int
+    stop_col: int
+    tokens: list[str]
+    types: list[int]
+
+    @property
+    def start(self) -> tuple[int, int]:
+        return self.start_line, self.start_col
+
+    @property
+    def stop(self) -> tuple[int, int]:
+        return self.stop_line, self.stop_col
+
+    def code_range(self, value: str, stop: tuple[int, int] | None = None) -> CodeRange:
+        stop_line, stop_col = stop or self.stop
+        return CodeRange(
+            start_line=self.start_line,
+            start_col=self.start_col,
+            stop_line=stop_line,
+            stop_col=stop_col,
+            value=value,
+        )
+
+
+def tokenize_logical_lines(source: str) -> list[LogicalLine]:
+    """
+    Splits python or cython source code into logical lines, with 0-based line numbers.
+    Comments, blank lines and indentation tokens are not part of any logical line.
+
+    NOTE:
+      This is a workaround for the missing end positions of the Cython AST (see `MainPreprocessor`).
+      The python tokenizer handles cython code, except for `?` in `except? -1`,
+      which is replaced with a space (keeping all positions intact)
+
+    :param source: Source code to tokenize
+    :return: The logical lines, in order
+    """
+    import io
+    import tokenize
+
+    skipped_types = {
+        tokenize.ENCODING,
+        tokenize.COMMENT,
+        tokenize.NL,
+        tokenize.INDENT,
+        tokenize.DEDENT,
+        tokenize.ENDMARKER,
+    }
+
+    logical_lines = []
+    tokens: list[tokenize.TokenInfo] = []
+    readline = io.StringIO(source.replace("?", " ")).readline
+    for token in tokenize.generate_tokens(readline):
+        if token.type in skipped_types:
+            continue
+
+        if token.type != tokenize.NEWLINE:
+            tokens.append(token)
+            continue
+
+        if tokens:
+            (start_line, start_col), (stop_line, stop_col) = (
+                tokens[0].start,
+                tokens[-1].end,
+            )
+            logical_lines.append(
+                LogicalLine(
+                    start_line=start_line - 1,
+                    start_col=start_col,
+                    stop_line=stop_line - 1,
+                    stop_col=stop_col,
+                    tokens=[token.string for token in tokens],
+                    types=[token.type for token in tokens],
+                )
+            )
+
+        tokens = []
+
+    return logical_lines
+
+
+def drop_nested_ranges(ranges: list[CodeRange]) -> list[CodeRange]:
+    """
+    :param ranges: Code ranges which are either nested or disjoint, e.g. taken from an AST
+    :return: The outermost code ranges
+    """
+    outer_ranges = []
+    for range in sorted(
+        ranges, key=lambda range: (range.start, -range.stop_line, -range.stop_col)
+    ):
+        if outer_ranges and range.start < outer_ranges[-1].stop:
+            continue
+
+        outer_ranges.append(range)
+
+    return outer_ranges
+
+
 class BasePreprocessor(Protocol):
     def process_package(self, package: list[ModuleDef]) -> list[ModuleDef]:
         new_package = []
@@ -238,3 +349,824 @@ class MainPreprocessor(BasePreprocessor):
             )
 
         return module.with_source(pyx_source=source_editor.build())
+
+
+def resolve_import(module: ModuleDef, name: str | None, level: int) -> str:
+    """
+    :param module: The module which contains the import statement
+    :param name: Imported module name, without the leading dots, if any
+    :param level: Number of leading dots, 0 for absolute imports
+    :return: Fully qualified name of the imported module
+    """
+    if level <= 0:
+        return name
+
+    parts = module.module_name.split(".")
+    if not module.is_package:
+        parts = parts[:-1]
+
+    parts = parts[: len(parts) - level + 1]
+    if name:
+        parts.append(name)
+
+    return ".".join(parts)
+
+
+@dataclass(frozen=True, kw_only=True)
+class ReachabilityPreprocessor(BasePreprocessor):
+    """
+    Drops the modules which cannot be reached from `entry_points` through static imports and cimports.
+
+    Modules which are only imported dynamically (e.g. `importlib.import_module`) must be listed
+    in `include_modules`, which accepts `fnmatch` patterns like `"package.backends.*"`.
+    The parent packages of every reachable module are always kept.
+    """
+
+    entry_points: list[str]
+    include_modules: list[str] = field(default_factory=list)
+
+    def process_package(self, package: list[ModuleDef]) -> list[ModuleDef]:
+        modules: dict[str, list[ModuleDef]] = {}
+        for module in package:
+            modules.setdefault(module.module_name, []).append(module)
+
+        for entry_point in self.entry_points:
+            if entry_point not in modules:
+                raise ValueError(f"Unknown entry point {entry_point!r}")
+
+        pending = list(self.entry_points)
+        for pattern in self.include_modules:
+            pending.extend(fnmatch.filter(modules, pattern))
+
+        reachable: set[str] = set()
+        while pending:
+            module_name = pending.pop()
+            if module_name in reachable or module_name not in modules:
+                continue
+
+            reachable.add(module_name)
+
+            parent_name = module_name.rpartition(".")[0]
+            if parent_name:
+                pending.append(parent_name)
+
+            for module in modules[module_name]:
+                pending.extend(self.find_imports(module))
+
+        return [module for module in package if module.module_name in reachable]
+
+    def find_imports(self, module: ModuleDef) -> set[str]:
+        imports = set()
+        if module.py_source is not None:
+            imports |= self.find_py_imports(module)
+
+        if module.pyx_source is not None:
+            imports |= self.find_cython_imports(module, module.pyx_source, "module")
+
+        if module.pxd_source is not None:
+            imports |= self.find_cython_imports(module, module.pxd_source, "module_pxd")
+
+        return imports
+
+    def find_py_imports(self, module: ModuleDef) -> set[str]:
+        assert module.py_source is not None
+
+        import ast
+
+        imports = set()
+        for node in ast.walk(ast.parse(module.py_source)):
+            if isinstance(node, ast.Import):
+                imports.update(alias.name for alias in node.names)
+
+            if isinstance(node, ast.ImportFrom):
+                base_name = resolve_import(module, node.module, node.level)
+                imports.add(base_name)
+                imports.update(f"{base_name}.{alias.name}" for alias in node.names)
+
+        return imports
+
+    def find_cython_imports(
+        self, module: ModuleDef, source: str, level: str
+    ) -> set[str]:
+        from Cython.Compiler.ExprNodes import ImportNode
+        from Cython.Compiler.Nodes import Node, CImportStatNode, FromCImportStatNode
+        from Cython.Compiler.TreeFragment import parse_from_strings
+
+        imports = set()
+
+        pending: list[Node] = [
+            parse_from_strings(module.module_name, source, level=level)
+        ]
+        while pending:
+            node = pending.pop()
+
+            if isinstance(node, CImportStatNode):
+                imports.add(node.module_name)
+
+            if isinstance(node, FromCImportStatNode):
+                base_name = resolve_import(
+                    module, node.module_name, node.relative_level or 0
+                )
+                imports.add(base_name)
+                imports.update(
+                    f"{base_name}.{name}" for _, name, *_ in node.imported_names
+                )
+
+            if isinstance(node, ImportNode):
+                base_name = resolve_import(
+                    module, node.module_name.value, max(node.level, 0)
+                )
+                imports.add(base_name)
+                imports.update(
+                    f"{base_name}.{name.value}" for name in node.imported_names or []
+                )
+
+            for attr in node.child_attrs:
+                children = getattr(node, attr, None)
+                if not isinstance(children, list):
+                    children = [children]
+
+                pending.extend(child for child in children if isinstance(child, Node))
+
+        return imports
+
+
+@dataclass(frozen=True, kw_only=True)
+class OptimizingPreprocessor(BasePreprocessor):
+    """
+    Rewrites modules for release builds, so Cython can emit tighter C:
+     - removes `assert` statements and docstrings
+     - removes `if __debug__:` blocks (without `else`) and folds other uses of `__debug__` to `False`
+     - removes calls to `debug_functions`, e.g. `"logger.debug"`, used as statements
+     - folds `constants` into literals, unless the name is rebound outside a module-level assignment
+    """
+
+    strip_asserts: bool = True
+    strip_docstrings: bool = True
+    strip_debug_blocks: bool = True
+    debug_functions: list[str] = field(default_factory=list)
+    constants: dict[str, object] = field(default_factory=dict)
+
+    def __post_init__(self):
+        import ast
+
+        for name, value in self.constants.items():
+            if not name.isidentifier():
+                raise ValueError(f"Invalid constant name {name!r}")
+
+            try:
+                is_literal = ast.literal_eval(repr(value)) == value
+            except (ValueError, SyntaxError):
+                is_literal = False
+
+            if not is_literal:
+                raise ValueError(f"Constant {name!r} cannot be folded into a literal")
+
+    @property
+    def folded_constants(self) -> dict[str, object]:
+        if self.strip_debug_blocks:
+            return {"__debug__": False, **self.constants}
+
+        return self.constants
+
+    def process_py_module(self, module: ModuleDef) -> ModuleDef:
+        assert module.py_source is not None
+
+        import ast
+
+        source_lines = module.py_source.splitlines(keepends=True)
+
+        def to_col(line: int, col_offset: int) -> int:
+            # NOTE: `ast` column offsets are in UTF-8 bytes
+            return len(source_lines[line].encode()[:col_offset].decode())
+
+        def code_range(node: ast.AST, value: str) -> CodeRange:
+            start_line = node.lineno - 1
+            stop_line = node.end_lineno - 1
+            return CodeRange(
+                start_line=start_line,
+                start_col=to_col(start_line, node.col_offset),
+                stop_line=stop_line,
+                stop_col=to_col(stop_line, node.end_col_offset),
+                value=value,
+            )
+
+        root = ast.parse(module.py_source)
+
+        module_targets = set()
+        for stmt in root.body:
+            if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1:
+                module_targets.add(id(stmt.targets[0]))
+
+            if isinstance(stmt, ast.AnnAssign) and stmt.simple:
+                module_targets.add(id(stmt.target))
+
+        bound_names = set()
+        for node in ast.walk(root):
+            if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+                if id(node) not in module_targets:
+                    bound_names.add(node.id)
+
+            if isinstance(node, ast.arg):
+                bound_names.add(node.arg)
+
+            if isinstance(node, ast.alias):
+                bound_names.add((node.asname or node.name).partition(".")[0])
+
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                bound_names.add(node.name)
+
+            if isinstance(node, (ast.Global, ast.Nonlocal)):
+                bound_names.update(node.names)
+
+            if isinstance(node, (ast.ExceptHandler, ast.MatchAs, ast.MatchStar)):
+                bound_names.add(node.name)
+
+        constants = {
+            name: value
+            for name, value in self.folded_constants.items()
+            if name not in bound_names
+        }
+
+        ranges: list[CodeRange] = []
+        for node in ast.walk(root):
+            if self.strip_docstrings and isinstance(
+                node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)
+            ):
+                if ast.get_docstring(node, clean=False) is not None:
+                    # NOTE: `pass` would break a following `from __future__ import`
+                    value = "" if isinstance(node, ast.Module) else "pass"
+                    ranges.append(code_range(node.body[0], value))
+
+            if self.strip_asserts and isinstance(node, ast.Assert):
+                ranges.append(code_range(node, "pass"))
+
+            if (
+                self.strip_debug_blocks
+                and isinstance(node, ast.If)
+                and isinstance(node.test, ast.Name)
+                and node.test.id == "__debug__"
+                and not node.orelse
+            ):
+                ranges.append(code_range(node, "pass"))
+
+            if isinstance(node, ast.Expr) and isinstance(node.value, ast.Call):
+                if self.is_debug_function(ast.unparse(node.value.func)):
+                    ranges.append(code_range(node, "pass"))
+
+            # NOTE: Parenthesized, e.g. `-1 ** 2` and `5.bit_length()` would change the meaning
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+                if node.id in constants:
+                    ranges.append(code_range(node, f"({constants[node.id]!r})"))
+
+        for stmt in root.body:
+            if isinstance(stmt, (ast.Assign, ast.AnnAssign)) and stmt.value is not None:
+                targets = (
+                    stmt.targets if isinstance(stmt, ast.Assign) else [stmt.target]
+                )
+                if len(targets) != 1 or not isinstance(targets[0], ast.Name):
+                    continue
+
+                if (name := targets[0].id) in constants:
+                    ranges.append(code_range(stmt.value, repr(constants[name])))
+
+        source_editor = SourceEditor(
+            source=module.py_source, ranges=drop_nested_ranges(ranges)
+        )
+        return module.with_source(py_source=source_editor.build())
+
+    def process_pyx_module(self, module: ModuleDef) -> ModuleDef:
+        assert module.pyx_source is not None
+
+        import tokenize
+
+        from Cython.Compiler.ExprNodes import NameNode, SimpleCallNode, GeneralCallNode
+        from Cython.Compiler.Nodes import (
+            Node,
+            StatListNode,
+            AssertStatNode,
+            IfStatNode,
+            ExprStatNode,
+            SingleAssignmentNode,
+            CascadedAssignmentNode,
+            InPlaceAssignmentNode,
+            ForInStatNode,
+            ForFromStatNode,
+            ExceptClauseNode,
+            FromImportStatNode,
+            FromCImportStatNode,
+            CImportStatNode,
+            CNameDeclaratorNode,
+            DefNode,
+            PyClassDefNode,
+            CClassDefNode,
+            DelStatNode,
+        )
+        from Cython.Compiler.TreeFragment import parse_from_strings
+
+        root = parse_from_strings(module.module_name, module.pyx_source)
+
+        logical_lines = tokenize_logical_lines(module.pyx_source)
+        line_index: dict[int, int] = {}
+        for idx, logical_line in enumerate(logical_lines):
+            for line in range(logical_line.start_line, logical_line.stop_line + 1):
+                line_index.setdefault(line, idx)
+
+        def find_line(node: Node) -> LogicalLine | None:
+            idx = line_index.get(node.pos[1] - 1)
+            if idx is None or ";" in logical_lines[idx].tokens:
+                return None
+            return logical_lines[idx]
+
+        def find_block_stop(header: LogicalLine) -> tuple[int, int]:
+            stop = header.stop
+            for logical_line in logical_lines[line_index[header.start_line] + 1 :]:
+                if logical_line.start_col <= header.start_col:
+                    break
+                stop = logical_line.stop
+            return stop
+
+        nodes: list[Node] = []
+        module_nodes: list[Node] = []
+        pending: list[tuple[Node, bool]] = [(root.body, True)]
+        while pending:
+            node, is_module_level = pending.pop()
+            nodes.append(node)
+            if is_module_level:
+                module_nodes.append(node)
+
+            for attr in node.child_attrs:
+                children = getattr(node, attr, None)
+                if not isinstance(children, list):
+                    children = [children]
+
+                pending.extend(
+                    (child, is_module_level and isinstance(node, StatListNode))
+                    for child in children
+                    if isinstance(child, Node)
+                )
+
+        module_targets = set()
+        for node in module_nodes:
+            if isinstance(node, SingleAssignmentNode) and isinstance(
+                node.lhs, NameNode
+            ):
+                module_targets.add(id(node.lhs))
+
+        targets = set()
+        bound_names = set()
+        for node in nodes:
+            if isinstance(node, SingleAssignmentNode):
+                targets.add(id(node.lhs))
+
+            if isinstance(node, CascadedAssignmentNode):
+                targets.update(map(id, node.lhs_list))
+
+            if isinstance(node, InPlaceAssignmentNode):
+                targets.add(id(node.lhs))
+
+            if isinstance(node, (ForInStatNode, ForFromStatNode, ExceptClauseNode)):
+                targets.add(id(node.target))
+
+            if isinstance(node, DelStatNode):
+                targets.update(map(id, node.args))
+
+            if isinstance(node, FromImportStatNode):
+                for name, target in node.items:
+                    targets.add(id(target))
+
+            if isinstance(node, FromCImportStatNode):
+                for _, name, as_name, *_ in node.imported_names:
+                    bound_names.add(as_name or name)
+
+            if isinstance(node, CImportStatNode):
+                bound_names.add(node.as_name or node.module_name.partition(".")[0])
+
+            if isinstance(node, (CNameDeclaratorNode, DefNode, PyClassDefNode)):
+                bound_names.add(node.name)
+
+            if isinstance(node, CClassDefNode):
+                bound_names.add(node.class_name)
+
+        for node in nodes:
+            if isinstance(node, NameNode) and id(node) in targets:
+                if id(node) not in module_targets:
+                    bound_names.add(node.name)
+
+        constants = {
+            name: value
+            for name, value in self.folded_constants.items()
+            if name not in bound_names
+        }
+
+        source_lines = module.pyx_source.splitlines(keepends=True)
+
+        ranges: list[CodeRange] = []
+        for node in nodes:
+            if self.strip_asserts and isinstance(node, AssertStatNode):
+                logical_line = find_line(node)
+                if logical_line is not None and logical_line.tokens[0] == "assert":
+                    ranges.append(logical_line.code_range("pass"))
+
+            if (
+                self.strip_debug_blocks
+                and isinstance(node, IfStatNode)
+                and len(node.if_clauses) == 1
+                and node.else_clause is None
+                and isinstance(node.if_clauses[0].condition, NameNode)
+                and node.if_clauses[0].condition.name == "__debug__"
+            ):
+                logical_line = find_line(node)
+                if logical_line is not None and logical_line.tokens[:3] == [
+                    "if",
+                    "__debug__",
+                    ":",
+                ]:
+                    stop = find_block_stop(logical_line)
+                    ranges.append(logical_line.code_range("pass", stop=stop))
+
+            if isinstance(node, ExprStatNode) and isinstance(
+                node.expr, (SimpleCallNode, GeneralCallNode)
+            ):
+                function_name = self.build_dotted_name(node.expr.function)
+                if function_name is not None and self.is_debug_function(function_name):
+                    logical_line = find_line(node)
+                    if logical_line is not None and self.is_single_call(
+                        logical_line, function_name
+                    ):
+                        ranges.append(logical_line.code_range("pass"))
+
+            if (
+                isinstance(node, NameNode)
+                and id(node) not in targets
+                and node.name in constants
+            ):
+                _, line, col = node.pos
+                if source_lines[line - 1][col : col + len(node.name)] == node.name:
+                    ranges.append(
+                        CodeRange(
+                            start_line=line - 1,
+                            start_col=col,
+                            stop_line=line - 1,
+                            stop_col=col + len(node.name),
+                            value=f"({constants[node.name]!r})",
+                        )
+                    )
+
+        for node in module_nodes:
+            if not isinstance(node, SingleAssignmentNode):
+                continue
+
+            if not isinstance(node.lhs, NameNode) or node.lhs.name not in constants:
+                continue
+
+            logical_line = find_line(node.lhs)
+            if logical_line is None or logical_line.tokens[:2] != [node.lhs.name, "="]:
+                continue
+
+            value = repr(constants[node.lhs.name])
+            ranges.append(logical_line.code_range(f"{node.lhs.name} = {value}"))
+
+        if self.strip_docstrings:
+            # NOTE:
+            #   Cython moves docstrings out of the tree, so they are found by their tokens.
+            #   Only the first statement of a module, function or class body is a docstring,
+            #   other string literals may be meaningful (e.g. the C code of `cdef extern from *`)
+            for idx, logical_line in enumerate(logical_lines):
+                if set(logical_line.types) != {tokenize.STRING}:
+                    continue
+
+                if idx > 0 and not (
+                    self.is_docstring_owner(logical_lines[idx - 1])
+                    and logical_line.start_col > logical_lines[idx - 1].start_col
+                ):
+                    continue
+
+                # NOTE: `pass` would break a following `from __future__ import`
+                value = "" if idx == 0 else "pass"
+                ranges.append(logical_line.code_range(value))
+
+        source_editor = SourceEditor(
+            source=module.pyx_source, ranges=drop_nested_ranges(ranges)
+        )
+        return module.with_source(pyx_source=source_editor.build())
+
+    def is_debug_function(self, function_name: str) -> bool:
+        return function_name in self.debug_functions
+
+    @staticmethod
+    def is_docstring_owner(logical_line: LogicalLine) -> bool:
+        """
+        Whether the logical line is the header of a function or class, whose body may start with a docstring
+        """
+        tokens = logical_line.tokens
+        if tokens[-1] != ":":
+            return False
+
+        if tokens[0] in {"def", "class"} or tokens[:2] == ["async", "def"]:
+            return True
+
+        # NOTE: `cdef extern`, `cdef struct` and `cdef:` blocks hold declarations, not a body
+        if tokens[0] in {"cdef", "cpdef"} and "extern" not in tokens:
+            return "class" in tokens or "(" in tokens
+
+        return False
+
+    @staticmethod
+    def build_dotted_name(node) -> str | None:
+        from Cython.Compiler.ExprNodes import NameNode, AttributeNode
+
+        if isinstance(node, NameNode):
+            return node.name
+
+        if isinstance(node, AttributeNode):
+            if (obj_name := OptimizingPreprocessor.build_dotted_name(node.obj)) is None:
+                return None
+            return f"{obj_name}.{node.attribute}"
+
+        return None
+
+    @staticmethod
+    def is_single_call(logical_line: LogicalLine, function_name: str) -> bool:
+        name_tokens = function_name.replace(".", " . ").split()
+        tokens = logical_line.tokens
+        if tokens[: len(name_tokens)] != name_tokens:
+            return False
+
+        if tokens[len(name_tokens) : len(name_tokens) + 1] != ["("]:
+            return False
+
+        depth = 0
+        for idx, token in enumerate(tokens[len(name_tokens) :], len(name_tokens)):
+            if token in {"(", "[", "{"}:
+                depth += 1
+            elif token in {")", "]", "}"}:
+                depth -= 1
+                if depth == 0:
+                    return idx == len(tokens) - 1
+
+        return False
+
+
+@dataclass(frozen=True, kw_only=True)
+class TypingPreprocessor(BasePreprocessor):
+    """
+    Generates an augmenting `.pxd` for `.py` modules, which declares their module-level functions
+    as `cpdef` with C-typed arguments, return values and locals (via `@cython.locals`).
+
+    Types come from the traces of a training run (see `TypeTracer`), confirmed by PEP 484 annotations.
+    It is conservative - a name is only typed if the traces observed exactly one plain builtin type for it
+    and its annotation (if any) is the same type. Without traces, no names are typed.
+
+    Functions are skipped if they can't become `cpdef` without changing their behaviour, e.g.
+    they are decorated, take `*args`, `**kwargs` or keyword-only arguments, contain closures
+    or generators, or are defined more than once. Modules with a handwritten `.pxd` are skipped.
+    So are functions with an annotated argument that can't be typed the way Cython types its annotation,
+    and arguments whose default isn't a literal of the observed type are left untyped.
+
+    NOTE:
+      `int` is only mapped to a C type if `int_type` is set (e.g. `"long"`), since C integers
+      overflow silently where python integers don't.
+    """
+
+    type_traces: Path | None = None
+    int_type: str | None = None
+
+    builtin_types = frozenset(
+        {"str", "bytes", "bytearray", "list", "dict", "set", "tuple"}
+    )
+
+    @functools.cached_property
+    def traces(self) -> dict[str, dict[str, dict[str, list[str]]]]:
+        from cythontools.package.tracing import load_type_traces
+
+        if self.type_traces is None:
+            return {}
+
+        return load_type_traces(self.type_traces)
+
+    def build_c_type(self, type_name: str | None) -> str | None:
+        c_types = {"float": "double", "bool": "bint", "int": self.int_type}
+        if type_name in c_types:
+            return c_types[type_name]
+
+        if type_name in self.builtin_types:
+            return type_name
+
+        return None
+
+    @staticmethod
+    def build_annotated_name(annotation) -> str | None:
+        """
+        :return: The type name of a plain annotation, e.g. `float` or `"float"`, None for other annotations
+        """
+        import ast
+
+        if isinstance(annotation, ast.Name):
+            return annotation.id
+
+        if isinstance(annotation, ast.Constant) and isinstance(annotation.value, str):
+            return annotation.value.strip()
+
+        return None
+
+    def resolve_type(self, annotation, observed: list[str] | None) -> str | None:
+        annotated = None
+        if annotation is not None:
+            if (annotated := self.build_annotated_name(annotation)) is None:
+                return None
+
+        # NOTE:
+        #   Annotations aren't enforced at runtime, e.g. a `bool` annotation alone would turn
+        #   `flag(5)` into `True`. They only confirm the type observed by the traces
+        if observed is None or len(observed) != 1:
+            return None
+
+        if annotated is not None and [annotated] != observed:
+            return None
+
+        (observed_type,) = observed
+        return self.build_c_type(observed_type)
+
+    @staticmethod
+    def is_default_of_type(default, observed: list[str] | None) -> bool:
+        """
+        Whether the default value of an argument is a literal of the single observed type,
+        e.g. a `None` default can't be assigned to a `double` argument.
+        """
+        import ast
+
+        try:
+            value = ast.literal_eval(default)
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+            return False
+
+        return observed == [type(value).__name__]
+
+    def is_convertible(self, function) -> bool:
+        import ast
+
+        args = function.args
+        if function.decorator_list or args.vararg or args.kwarg:
+            return False
+
+        if args.posonlyargs or args.kwonlyargs:
+            return False
+
+        for node in ast.walk(function):
+            if node is function:
+                continue
+
+            if isinstance(
+                node,
+                (
+                    ast.FunctionDef,
+                    ast.AsyncFunctionDef,
+                    ast.ClassDef,
+                    ast.Lambda,
+                    ast.GeneratorExp,
+                    ast.Yield,
+                    ast.YieldFrom,
+                    ast.Await,
+                    ast.Global,
+                    ast.Nonlocal,
+                ),
+            ):
+                return False
+
+        return True
+
+    def process_py_module(self, module: ModuleDef) -> ModuleDef:
+        assert module.py_source is not None
+
+        import ast
+        import collections
+
+        if module.pxd_source is not None:
+            return module
+
+        root = ast.parse(module.py_source)
+        module_traces = self.traces.get(module.module_name, {})
+
+        definitions = collections.Counter()
+        for node in ast.walk(root):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                definitions[node.name] += 1
+
+            if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+                definitions[node.id] += 1
+
+            if isinstance(node, ast.alias):
+                definitions[(node.asname or node.name).partition(".")[0]] += 1
+
+        declarations = []
+        for function in root.body:
+            if not isinstance(function, ast.FunctionDef):
+                continue
+
+            if definitions[function.name] != 1 or not self.is_convertible(function):
+                continue
+
+            function_traces = module_traces.get(function.name, {})
+
+            args = function.args.args
+            defaults = [None] * (len(args) - len(function.args.defaults))
+            defaults += function.args.defaults
+
+            arg_declarations = []
+            arg_names = set()
+            for arg, default in zip(args, defaults):
+                arg_names.add(arg.arg)
+                observed = function_traces.get(arg.arg)
+                c_type = self.resolve_type(arg.annotation, observed)
+                if default is not None and not self.is_default_of_type(
+                    default, observed
+                ):
+                    c_type = None
+
+                # NOTE:
+                #   Cython types annotated arguments itself, so their declaration must match the annotation.
+                #   `int` annotations stay python objects, which can't be declared in the `.pxd`
+                if arg.annotation is not None and (
+                    c_type is None or self.build_annotated_name(arg.annotation) == "int"
+                ):
+                    break
+
+                arg_declaration = f"{c_type} {arg.arg}" if c_type else arg.arg
+                arg_declarations.append(
+                    arg_declaration if default is None else f"{arg_declaration}=*"
+                )
+
+            if len(arg_declarations) != len(args):
+                continue
+
+            return_type = self.resolve_type(
+                function.returns, function_traces.get("return")
+            )
+
+            annotated_names = set()
+            local_names = set()
+            deleted_names = set()
+            pending = list(function.body)
+            while pending:
+                node = pending.pop()
+
+                # NOTE: Comprehension variables are not function locals
+                if isinstance(node, (ast.ListComp, ast.SetComp, ast.DictComp)):
+                    continue
+
+                if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+                    local_names.add(node.id)
+
+                if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Del):
+                    deleted_names.add(node.id)
+
+                if isinstance(node, ast.AnnAssign) and isinstance(
+                    node.target, ast.Name
+                ):
+                    annotated_names.add(node.target.id)
+
+                pending.extend(ast.iter_child_nodes(node))
+
+            # NOTE: Annotated locals are typed by Cython, declaring them again is an error
+            local_types = {}
+            for name in sorted(
+                local_names - arg_names - deleted_names - annotated_names
+            ):
+                c_type = self.resolve_type(None, function_traces.get(name))
+                if c_type is not None:
+                    local_types[name] = c_type
+
+            if (
+                not local_types
+                and not return_type
+                and arg_declarations == [arg.arg for arg in args]
+            ):
+                continue
+
+            declaration = ""
+            if local_types:
+                locals_code = ", ".join(
+                    (
+                        f"{name}={c_type}"
+                        if c_type in self.builtin_types
+                        else f"{name}=cython.{c_type}"
+                    )
+                    for name, c_type in local_types.items()
+                )
+                declaration += f"@cython.locals({locals_code})\n"
+
+            signature = ", ".join(arg_declarations)
+            if return_type is not None:
+                declaration += f"cpdef {return_type} {function.name}({signature})\n"
+            else:
+                declaration += f"cpdef {function.name}({signature})\n"
+
+            declarations.append(declaration)
+
+        if not declarations:
+            return module
+
+        return module.with_source(
+            pxd_source="cimport cython\n\n" + "\n".join(declarations)
+        )
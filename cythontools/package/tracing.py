@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import sys
+import json
+import threading
+import functools
+
+from types import FrameType
+from pathlib import Path
+from dataclasses import dataclass, field
+
+TypeTraces = dict[str, dict[str, dict[str, list[str]]]]
+
+
+def load_type_traces(path: Path) -> TypeTraces:
+    """
+    :param path: A JSON file saved by `TypeTracer.save`
+    :return: Observed type names, by module, module-level function and argument/local name (`"return"` for the return value)
+    """
+    return json.loads(path.read_text())
+
+
+def build_type_name(value: object) -> str:
+    value_type = type(value)
+    if value_type.__module__ == "builtins":
+        return value_type.__qualname__
+
+    return f"{value_type.__module__}.{value_type.__qualname__}"
+
+
+@dataclass(kw_only=True)
+class TypeTracer:
+    """
+    Records the types of arguments, locals and return values of module-level functions,
+    while running a training workload with the uncompiled sources, e.g.
+        ```py
+        with TypeTracer(module_prefixes=["mypackage"]) as tracer:
+            run_workload()
+        tracer.save(Path("types.json"))
+        ```
+
+    The saved traces are consumed by `TypingPreprocessor`.
+
+    NOTE:
+      Locals are sampled on every line event, so a local which changes its type
+      within a function is recorded as polymorphic.
+    """
+
+    module_prefixes: list[str]
+    traces: dict[str, dict[str, dict[str, set[str]]]] = field(default_factory=dict)
+
+    def __enter__(self) -> TypeTracer:
+        self.previous_trace = sys.gettrace()
+        threading.settrace(self.trace)
+        sys.settrace(self.trace)
+        return self
+
+    def __exit__(self, *_):
+        sys.settrace(self.previous_trace)
+        threading.settrace(None)
+
+    def trace(self, frame: FrameType, event: str, arg):
+        if event != "call":
+            return None
+
+        module_name = frame.f_globals.get("__name__", "")
+        if not any(
+            module_name == prefix or module_name.startswith(f"{prefix}.")
+            for prefix in self.module_prefixes
+        ):
+            return None
+
+        code = frame.f_code
+        if code.co_qualname != code.co_name or code.co_name.startswith("<"):
+            return None
+
+        function_traces = self.traces.setdefault(module_name, {}).setdefault(
+            code.co_name, {}
+        )
+        self.record(function_traces, frame.f_locals)
+
+        return functools.partial(self.trace_function, function_traces)
+
+    def trace_function(
+        self,
+        function_traces: dict[str, set[str]],
+        frame: FrameType,
+        event: str,
+        arg,
+    ):
+        self.record(function_traces, frame.f_locals)
+        if event == "return":
+            self.record(function_traces, {"return": arg})
+
+        return functools.partial(self.trace_function, function_traces)
+
+    def record(self, function_traces: dict[str, set[str]], values: dict[str, object]):
+        for name, value in values.items():
+            function_traces.setdefault(name, set()).add(build_type_name(value))
+
+    def save(self, path: Path):
+        traces: TypeTraces = {
+            module_name: {
+                function_name: {
+                    name: sorted(type_names)
+                    for name, type_names in function_traces.items()
+                }
+                for function_name, function_traces in module_traces.items()
+            }
+            for module_name, module_traces in self.traces.items()
+        }
+        path.write_text(json.dumps(traces, indent=2, sort_keys=True))
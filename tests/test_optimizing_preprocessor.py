@@ -0,0 +1,58 @@
+from pathlib import Path
+
+from cythontools.package.common import ModuleDef
+from cythontools.package.preprocessors import OptimizingPreprocessor
+
+
+def build_module(**sources: str) -> ModuleDef:
+    return ModuleDef(
+        is_package=False,
+        module_name="module",
+        initializer_name="PyInit_module",
+        c_path=Path("module.c"),
+        **sources,
+    )
+
+
+def test_folded_constants_keep_precedence():
+    preprocessor = OptimizingPreprocessor(constants={"LEVEL": 5, "NEG": -1})
+    (module,) = preprocessor.process_package(
+        [
+            build_module(
+                py_source=(
+                    "LEVEL = 0\n"
+                    "NEG = 0\n"
+                    "bits = LEVEL.bit_length()\n"
+                    "square = NEG ** 2\n"
+                )
+            )
+        ]
+    )
+
+    namespace = {}
+    exec(module.py_source, namespace)
+    assert namespace["bits"] == 3
+    assert namespace["square"] == 1
+
+
+def test_folded_constants_keep_precedence_pyx():
+    preprocessor = OptimizingPreprocessor(constants={"LEVEL": 5, "NEG": -1})
+    (module,) = preprocessor.process_package(
+        [
+            build_module(
+                pyx_source=(
+                    "LEVEL = 0\n"
+                    "NEG = 0\n"
+                    "cdef int bits = LEVEL.bit_length()\n"
+                    "cdef int square = NEG ** 2\n"
+                )
+            )
+        ]
+    )
+
+    assert module.pyx_source == (
+        "LEVEL = 5\n"
+        "NEG = -1\n"
+        "cdef int bits = (5).bit_length()\n"
+        "cdef int square = (-1) ** 2\n"
+    )
@@ -0,0 +1,103 @@
+import json
+
+from pathlib import Path
+
+import pytest
+
+from Cython.Compiler.Main import compile
+
+from cythontools.package.common import ModuleDef
+from cythontools.package.preprocessors import TypingPreprocessor
+
+
+def build_pxd(tmp_path: Path, py_source: str, traces: dict, **kwargs) -> str | None:
+    traces_path = tmp_path / "types.json"
+    traces_path.write_text(json.dumps({"module": traces}))
+
+    module = ModuleDef(
+        is_package=False,
+        module_name="module",
+        initializer_name="PyInit_module",
+        c_path=tmp_path / "module.c",
+        py_source=py_source,
+    )
+    preprocessor = TypingPreprocessor(type_traces=traces_path, **kwargs)
+    (module,) = preprocessor.process_package([module])
+    module.save()
+    return module.pxd_source
+
+
+@pytest.mark.parametrize(
+    "py_source, traces, kwargs",
+    [
+        (
+            "def f(s: str, n: int):\n    return s * n\n",
+            {"f": {"s": ["str"], "n": ["int"], "return": ["str"]}},
+            {},
+        ),
+        (
+            "def f(s: str, n: int):\n    return s * n\n",
+            {"f": {"s": ["str"], "n": ["int"], "return": ["str"]}},
+            {"int_type": "long"},
+        ),
+        (
+            "def f(x: float, y):\n    return x + y\n",
+            {"f": {"x": ["float", "int"], "y": ["float"]}},
+            {},
+        ),
+        (
+            "def f(x: list, y):\n    return x, y\n",
+            {"f": {"y": ["float"]}},
+            {},
+        ),
+        (
+            "def add(x, y, scale=None):\n"
+            "    if scale is None:\n"
+            "        scale = 1.0\n"
+            "    return (x + y) * scale\n",
+            {
+                "add": {
+                    "x": ["float"],
+                    "y": ["float"],
+                    "scale": ["float"],
+                    "return": ["float"],
+                }
+            },
+            {},
+        ),
+        (
+            "def add(x: float, scale: float = None):\n    return x * (scale or 1.0)\n",
+            {"add": {"x": ["float"], "scale": ["float"], "return": ["float"]}},
+            {},
+        ),
+        (
+            "def f(x):\n    y: float = x * 2\n    z = y + 1\n    return z\n",
+            {"f": {"x": ["float"], "y": ["float"], "z": ["float"]}},
+            {},
+        ),
+    ],
+)
+def test_pxd_compiles(tmp_path: Path, py_source: str, traces: dict, kwargs: dict):
+    build_pxd(tmp_path, py_source, traces, **kwargs)
+
+    result = compile(str(tmp_path / "module.py"), quiet=True)
+    assert result.num_errors == 0
+
+
+def test_int_annotated_argument(tmp_path: Path):
+    pxd_source = build_pxd(
+        tmp_path,
+        "def f(s: str, n: int):\n    return s * n\n",
+        {"f": {"s": ["str"], "n": ["int"]}},
+    )
+    assert pxd_source is None
+
+
+def test_default_of_other_type(tmp_path: Path):
+    pxd_source = build_pxd(
+        tmp_path,
+        "def add(x, y, scale=None):\n    return x + y\n",
+        {"add": {"x": ["float"], "y": ["float"], "scale": ["float"]}},
+    )
+    assert pxd_source is not None
+    assert "cpdef add(double x, double y, scale=*)" in pxd_source
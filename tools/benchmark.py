@@ -0,0 +1,414 @@
+"""
+Build and import benchmarks for bundled extensions, on synthetic packages.
+
+    ```sh
+    python tools/benchmark.py run --modules 200 --depth 3 --output before.json
+    # ... change something ...
+    python tools/benchmark.py run --modules 200 --depth 3 --output after.json
+    python tools/benchmark.py compare before.json after.json
+    ```
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import dataclasses
+import platform
+import statistics
+import subprocess
+
+from pathlib import Path
+from dataclasses import dataclass, asdict
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cythontools.package.watch import PackageWatcher
+from cythontools.package.builder import CythonBuilder
+from cythontools.package.preprocessors import default_preprocessors
+
+
+@dataclass(frozen=True, kw_only=True)
+class SyntheticPackage:
+    """
+    Generates a package tree with a configurable shape.
+
+    Modules are spread round-robin over the subpackages, `breadth` subpackages per package
+    and `depth` levels deep. A `pyx_ratio` fraction of the modules are `*.pyx` files with a `*.pxd`,
+    each of which cimports `cimport_fanout` of the preceding ones, so the cimport graph is acyclic.
+
+    NOTE:
+      The first module has a `__main__` block, so it can be used as the entry point of an executable.
+    """
+
+    name: str = "synthetic"
+    modules: int = 50
+    depth: int = 2
+    breadth: int = 3
+    functions: int = 10
+    statements: int = 5
+    pyx_ratio: float = 0.0
+    cimport_fanout: int = 0
+    seed: int = 0
+
+    def package_names(self) -> list[str]:
+        package_names = [self.name]
+        level = [self.name]
+        for _ in range(self.depth):
+            level = [
+                f"{parent}.sub_{idx}" for parent in level for idx in range(self.breadth)
+            ]
+            package_names.extend(level)
+
+        return package_names
+
+    def module_names(self) -> list[str]:
+        package_names = self.package_names()
+        return [
+            f"{package_names[idx % len(package_names)]}.mod_{idx}"
+            for idx in range(self.modules)
+        ]
+
+    def build_py_source(self, idx: int) -> str:
+        lines: list[str] = []
+        for function_idx in range(self.functions):
+            lines.append(f"def func_{function_idx}(x):")
+            lines.append("    y = x")
+            for statement_idx in range(self.statements):
+                lines.append(f"    y = y * {statement_idx + 1} + {idx}")
+            lines.append("    return y")
+            lines.append("")
+
+        if idx == 0:
+            lines.append('if __name__ == "__main__":')
+            lines.append("    func_0(1)")
+            lines.append("")
+
+        return "\n".join(lines)
+
+    def build_pyx_source(self, idx: int, cimports: list[str]) -> tuple[str, str]:
+        pxd_lines: list[str] = []
+        pyx_lines: list[str] = []
+        for module_name in cimports:
+            alias = module_name.replace(".", "_")
+            pyx_lines.append(f"from {module_name} cimport cfunc_0 as {alias}")
+        pyx_lines.append("")
+
+        for function_idx in range(self.functions):
+            pxd_lines.append(f"cdef long cfunc_{function_idx}(long x)")
+
+            pyx_lines.append(f"cdef long cfunc_{function_idx}(long x):")
+            pyx_lines.append("    cdef long y = x")
+            for statement_idx in range(self.statements):
+                pyx_lines.append(f"    y = y * {statement_idx + 1} + {idx}")
+            if function_idx == 0:
+                for module_name in cimports:
+                    pyx_lines.append(f"    y += {module_name.replace('.', '_')}(x)")
+            pyx_lines.append("    return y")
+            pyx_lines.append("")
+            pyx_lines.append(f"def func_{function_idx}(x):")
+            pyx_lines.append(f"    return cfunc_{function_idx}(x)")
+            pyx_lines.append("")
+
+        return "\n".join(pyx_lines), "\n".join(pxd_lines) + "\n"
+
+    def generate(self, root: Path) -> Path:
+        """
+        :param root: Directory to generate the package in, any previous contents are removed
+        :return: Path to the generated package
+        """
+        shutil.rmtree(root / self.name, ignore_errors=True)
+
+        for package_name in self.package_names():
+            package_path = root.joinpath(*package_name.split("."))
+            package_path.mkdir(parents=True, exist_ok=True)
+            (package_path / "__init__.py").write_text("")
+
+        rng = random.Random(self.seed)
+        pyx_modules: list[str] = []
+        for idx, module_name in enumerate(self.module_names()):
+            module_path = root.joinpath(*module_name.split("."))
+            if idx == 0 or rng.random() >= self.pyx_ratio:
+                module_path.with_suffix(".py").write_text(self.build_py_source(idx))
+                continue
+
+            cimports = rng.sample(
+                pyx_modules, min(self.cimport_fanout, len(pyx_modules))
+            )
+            pyx_source, pxd_source = self.build_pyx_source(idx, cimports)
+            module_path.with_suffix(".pyx").write_text(pyx_source)
+            module_path.with_suffix(".pxd").write_text(pxd_source)
+            pyx_modules.append(module_name)
+
+        return root / self.name
+
+
+IMPORT_SCRIPT = """
+import sys, json, time, resource
+
+sys.path.insert(0, {output_path!r})
+
+def rss():
+    # NOTE: `ru_maxrss` is a peak which is inherited from the benchmark process on Linux
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+rss_interpreter = rss()
+
+start = time.perf_counter()
+import {package_name}
+root_imported = time.perf_counter()
+rss_root = rss()
+
+import {module_name}
+module_imported = time.perf_counter()
+rss_module = rss()
+
+print(json.dumps({{
+    "import_root_ms": (root_imported - start) * 1000,
+    "import_first_submodule_ms": (module_imported - root_imported) * 1000,
+    "rss_interpreter_kib": rss_interpreter,
+    "rss_root_kib": rss_root,
+    "rss_first_submodule_kib": rss_module,
+}}))
+"""
+
+
+def run_process(args: list[str], **kwargs) -> str:
+    return subprocess.run(
+        args, check=True, capture_output=True, text=True, **kwargs
+    ).stdout
+
+
+def time_process(args: list[str], repeat: int, **kwargs) -> float:
+    timings: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_process(args, **kwargs)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(timings)
+
+
+def time_call(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def measure_imports(
+    package: SyntheticPackage, output_path: Path, repeat: int
+) -> dict[str, float]:
+    """
+    Each sample runs in a fresh interpreter, the median of every metric is reported.
+    The RSS values are current resident set sizes after each step.
+    """
+    module_name = max(package.module_names(), key=lambda name: name.count("."))
+    script = IMPORT_SCRIPT.format(
+        output_path=str(output_path),
+        package_name=package.name,
+        module_name=module_name,
+    )
+
+    samples = [
+        json.loads(run_process([sys.executable, "-I", "-c", script]))
+        for _ in range(repeat)
+    ]
+    return {
+        key: statistics.median(sample[key] for sample in samples) for key in samples[0]
+    }
+
+
+def measure_executable(
+    package: SyntheticPackage,
+    builder: CythonBuilder,
+    package_path: Path,
+    output_path: Path,
+    build_temp: Path,
+    repeat: int,
+) -> dict[str, float]:
+    """
+    Compares the startup of a standalone executable with `python -m` on the bundled extension.
+
+    NOTE:
+      The executable is built without `site`, so it is comparable with `python -S -m`.
+      `python -m` is reported as well, since that is how the extension would normally be run.
+    """
+    # NOTE:
+    #   The executable gets its own working path, since its `bootstrap` is generated for a different extension name
+    builder = dataclasses.replace(
+        builder, working_path=builder.working_path.parent / "executable"
+    )
+
+    main_module = package.module_names()[0]
+    executable_path = builder.make_executable_from_packages(
+        f"{package.name}_exe",
+        {package.name: package_path},
+        main_module=main_module,
+        output_path=output_path,
+        build_temp=build_temp / "executable",
+        site_import=False,
+    )
+
+    environment = {**os.environ, "PYTHONPATH": str(output_path)}
+    return {
+        "executable_startup_ms": time_process([str(executable_path)], repeat),
+        "python_m_startup_ms": time_process(
+            [sys.executable, "-s", "-m", main_module], repeat, env=environment
+        ),
+        "python_s_m_startup_ms": time_process(
+            [sys.executable, "-s", "-S", "-m", main_module], repeat, env=environment
+        ),
+    }
+
+
+def build_git_commit() -> str | None:
+    try:
+        return run_process(
+            ["git", "rev-parse", "HEAD"], cwd=Path(__file__).resolve().parent
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args: argparse.Namespace):
+    package = SyntheticPackage(
+        modules=args.modules,
+        depth=args.depth,
+        breadth=args.breadth,
+        functions=args.functions,
+        statements=args.statements,
+        pyx_ratio=args.pyx_ratio,
+        cimport_fanout=args.cimport_fanout,
+        seed=args.seed,
+    )
+
+    root = args.root.resolve()
+    shutil.rmtree(root, ignore_errors=True)
+
+    source_path = root / "src"
+    output_path = root / "out"
+    build_temp = root / "build" / "temp"
+    output_path.mkdir(parents=True)
+
+    package_path = package.generate(source_path)
+
+    builder = CythonBuilder(
+        preprocessors=default_preprocessors(release=args.release),
+        working_path=root / "build" / "generated",
+        quiet=True,
+    )
+    watcher = PackageWatcher(
+        builder=builder,
+        package_name=package.name,
+        package_paths=[package_path],
+        output_path=output_path,
+        build_temp=build_temp,
+        shard=args.shard,
+        shard_size=args.shard_size,
+    )
+
+    results: dict[str, float] = {}
+    results["cold_build_s"] = time_call(watcher.rebuild)
+    results["noop_build_s"] = time_call(watcher.rebuild)
+
+    # NOTE:
+    #   The edit changes the generated code, not just a comment,
+    #   so the module's object has to be recompiled as well
+    module_path = package_path.parent.joinpath(*package.module_names()[0].split("."))
+    module_path = module_path.with_suffix(".py")
+    with module_path.open("a") as file:
+        file.write("\n__benchmark_edit__ = 1\n")
+    results["incremental_build_s"] = time_call(watcher.rebuild)
+
+    results |= measure_imports(package, output_path, args.repeat)
+
+    if args.executable:
+        results |= measure_executable(
+            package, builder, package_path, output_path, build_temp, args.repeat
+        )
+
+    report = {
+        "commit": build_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "package": asdict(package),
+        "release": args.release,
+        "shard": args.shard,
+        "shard_size": args.shard_size,
+        "results": results,
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+def compare(args: argparse.Namespace):
+    baseline = json.loads(args.baseline.read_text())
+    current = json.loads(args.current.read_text())
+
+    if baseline["package"] != current["package"]:
+        print("WARNING: The reports were generated from different packages")
+
+    print(f"{'metric':<28} {'baseline':>12} {'current':>12} {'change':>9}")
+    for key, current_value in current["results"].items():
+        if (baseline_value := baseline["results"].get(key)) is None:
+            continue
+
+        change = "n/a"
+        if baseline_value != 0:
+            change = f"{(current_value - baseline_value) / baseline_value * 100:+.1f}%"
+
+        print(f"{key:<28} {baseline_value:>12.3f} {current_value:>12.3f} {change:>9}")
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python tools/benchmark.py")
+    subparsers = parser.add_subparsers(required=True)
+
+    run_parser = subparsers.add_parser(
+        "run", help="Build a synthetic package and measure build and import times"
+    )
+    run_parser.set_defaults(command=run)
+    run_parser.add_argument("--root", type=Path, default=Path("./build/benchmark/"))
+    run_parser.add_argument("--output", type=Path, default=None)
+    run_parser.add_argument("--modules", type=int, default=50)
+    run_parser.add_argument("--depth", type=int, default=2)
+    run_parser.add_argument("--breadth", type=int, default=3)
+    run_parser.add_argument("--functions", type=int, default=10)
+    run_parser.add_argument("--statements", type=int, default=5)
+    run_parser.add_argument("--pyx-ratio", type=float, default=0.0)
+    run_parser.add_argument("--cimport-fanout", type=int, default=0)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--repeat", type=int, default=10)
+    run_parser.add_argument("--release", action="store_true")
+    run_parser.add_argument("--shard", action="store_true")
+    run_parser.add_argument("--shard-size", type=int, default=None)
+    run_parser.add_argument("--executable", action="store_true")
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Compare the results of two benchmark runs"
+    )
+    compare_parser.set_defaults(command=compare)
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("current", type=Path)
+
+    args = parser.parse_args(argv)
+    args.command(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Checks that deterministic builds don't depend on the checkout path.
+
+Builds the same synthetic package (see `tools/benchmark.py`) in two different directories
+and compares the hashes of the generated files and of the extensions.
+
+    ```sh
+    python tools/reproducibility.py --modules 20 --pyx-ratio 0.5 --cimport-fanout 2
+    ```
+"""
+
+from __future__ import annotations
+
+import sys
+import hashlib
+import argparse
+import tempfile
+
+from pathlib import Path
+
+from benchmark import SyntheticPackage
+
+from cythontools.package.watch import PackageWatcher
+from cythontools.package.builder import CythonBuilder
+
+
+def build_hashes(root: Path, package: SyntheticPackage, shard: bool) -> dict[str, str]:
+    """
+    :param root: Directory to build in
+    :param package: Package to generate and build
+    :param shard: Build sharded extensions
+    :return: Hashes of the generated sources and extensions, by their path relative to `root`
+    """
+    # NOTE: Absolute paths, like isolated builds in a temporary directory would use
+    package_path = package.generate(root / "src")
+    output_path = root / "out"
+    output_path.mkdir()
+
+    watcher = PackageWatcher(
+        builder=CythonBuilder(
+            working_path=root / "build" / "generated",
+            deterministic=True,
+            quiet=True,
+        ),
+        package_name=package.name,
+        package_paths=[package_path],
+        output_path=output_path,
+        build_temp=root / "build" / "temp",
+        shard=shard,
+    )
+    watcher.rebuild()
+
+    paths = [
+        *(
+            path
+            for path in (root / "build" / "generated").rglob("*.*")
+            if path.suffix in {".c", ".h", ".pyx", ".pxd", ".py"}
+        ),
+        *output_path.iterdir(),
+    ]
+    return {
+        path.relative_to(root).as_posix(): hashlib.sha256(path.read_bytes()).hexdigest()
+        for path in sorted(paths)
+    }
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python tools/reproducibility.py")
+    parser.add_argument("--modules", type=int, default=20)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--pyx-ratio", type=float, default=0.0)
+    parser.add_argument("--cimport-fanout", type=int, default=0)
+    parser.add_argument("--shard", action="store_true")
+    args = parser.parse_args(argv)
+
+    package = SyntheticPackage(
+        modules=args.modules,
+        depth=args.depth,
+        pyx_ratio=args.pyx_ratio,
+        cimport_fanout=args.cimport_fanout,
+    )
+
+    with (
+        tempfile.TemporaryDirectory() as first,
+        tempfile.TemporaryDirectory() as second,
+    ):
+        first_path = Path(first) / "checkout"
+        second_path = Path(second) / "another" / "checkout"
+        first_path.mkdir(parents=True)
+        second_path.mkdir(parents=True)
+
+        first_hashes = build_hashes(first_path, package, args.shard)
+        second_hashes = build_hashes(second_path, package, args.shard)
+
+    mismatches = sorted(
+        path
+        for path in first_hashes.keys() | second_hashes.keys()
+        if first_hashes.get(path) != second_hashes.get(path)
+    )
+    for path in mismatches:
+        print(f"MISMATCH {path}")
+
+    print(f"{len(first_hashes) - len(mismatches)}/{len(first_hashes)} files identical")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()